@@ -17,6 +17,15 @@ class ExtractedData(object):
         # build the time-IFT-volume-area array used in the plotting function
         return [self.time[i], self.gamma_IFT_mN[i], self.volume[i], self.area[i]]
    
+    def frame_values(self, i):
+        # the results of frame i, for merging into another ExtractedData (e.g. from a worker process)
+        return [self.time[i], self.gamma_IFT_mN[i], self.pixels_to_mm[i], self.volume[i],
+                self.area[i], self.worthington[i], self.parameters[i].copy()]
+
+    def set_frame_values(self, i, values):
+        (self.time[i], self.gamma_IFT_mN[i], self.pixels_to_mm[i], self.volume[i],
+         self.area[i], self.worthington[i], self.parameters[i]) = values
+
     def output_data(self,i):
         # builds the output array
         array = np.concatenate((np.array([self.time[i], self.gamma_IFT_mN[i], self.volume[i], self.area[i],self.worthington[i]]), self.parameters[i]))
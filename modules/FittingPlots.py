@@ -10,10 +10,16 @@ sin = np.sin
 dot = np.dot
 
 class FittingPlots(object):
-    def __init__(self):
-        plt.ion()
+    # with a plot_process (see plot_process.py) the plots are drawn by that process,
+    # otherwise they are drawn here in interactive mode
+    def __init__(self, plot_process=None):
+        self.plot_process = plot_process
+        if plot_process is None:
+            plt.ion()
         self.residual_initialised = False
         self.profile_initialised = False
+        self.image_sent = False
+        self.pending = None
 
 
     # def setup_plots(self, experimental_drop, residual_plot_boole=False, profile_plot_boole=False):
@@ -24,22 +30,57 @@ class FittingPlots(object):
     #         self.setup_profile_plot(experimental_drop)
 
     def update_plots(self, experimental_drop, fitted_drop, user_inputs):
+        if self.plot_process is not None:
+            self.send_plots(experimental_drop, fitted_drop, user_inputs)
+            return
         if user_inputs.profiles_boole:
             self.update_profile_plot(experimental_drop, fitted_drop)
         if user_inputs.residuals_boole:
             self.update_residual_plot(experimental_drop, fitted_drop)
 
-    def setup_profile_plot(self, experimental_drop, fitted_drop):
+    # sends a snapshot of the plots to the plot process, unless the rate limit skips it
+    # (the drop image goes with the first snapshot, which is never skipped)
+    def send_plots(self, experimental_drop, fitted_drop, user_inputs, force=False):
+        force = force or not self.image_sent
+        if not (force or self.plot_process.due('fitting')):
+            self.pending = (experimental_drop, fitted_drop, user_inputs)
+            return
+        snapshot = {}
+        if user_inputs.profiles_boole:
+            snapshot['profile'] = self.profile_plot_data(fitted_drop)
+            if not self.image_sent:
+                snapshot['image'] = experimental_drop.image
+        if user_inputs.residuals_boole:
+            snapshot['residuals'] = self.residual_plot_data(experimental_drop, fitted_drop)
+        self.plot_process.send('fitting', snapshot, force)
+        self.image_sent = True
+        self.pending = None
+
+    # sends the last snapshot skipped by the rate limit, so the plots end on the fitted drop
+    def flush(self):
+        if (self.plot_process is not None) and (self.pending is not None):
+            self.send_plots(*self.pending, force=True)
+
+    # draws a snapshot made by send_plots (in the plot process)
+    def draw_snapshot(self, snapshot):
+        if ('image' in snapshot) and ('profile' in snapshot):
+            self.setup_profile_plot(snapshot['image'], len(snapshot['profile'][0]))
+            self.profile_initialised = True
+        if ('profile' in snapshot) and self.profile_initialised:
+            self.draw_profile_plot(*snapshot['profile'])
+        if 'residuals' in snapshot:
+            self.draw_residual_plot(*snapshot['residuals'])
+
+    def setup_profile_plot(self, image, n_points):
         self.fig_profile = plt.figure("Drop profile")
         plt.clf()
         self.subfig_profile = self.fig_profile.add_subplot(1,1,1)
-        height, width = experimental_drop.image.shape[:2]
-        plt.imshow(np.flipud(experimental_drop.image), origin='lower', cmap = 'gray')
+        height, width = image.shape[:2]
+        plt.imshow(np.flipud(image), origin='lower', cmap = 'gray')
         plt.axis([0, width, 0, height], aspect=1)
         # x_data, y_data = generate_profile()
-        spoints = fitted_drop.s_points
-        self.profile_line_left, = self.subfig_profile.plot(np.zeros(spoints+1), np.zeros(spoints+1), "--r", linewidth = 2.0)
-        self.profile_line_right, = self.subfig_profile.plot(np.zeros(spoints+1), np.zeros(spoints+1), "--r", linewidth = 2.0)
+        self.profile_line_left, = self.subfig_profile.plot(np.zeros(n_points), np.zeros(n_points), "--r", linewidth = 2.0)
+        self.profile_line_right, = self.subfig_profile.plot(np.zeros(n_points), np.zeros(n_points), "--r", linewidth = 2.0)
 
 
         # self.subfig_profile.plot(x_data, y_data, '--r', linewidth = 2.0)
@@ -60,23 +101,25 @@ class FittingPlots(object):
         # # self.residual_data, = self.subfig_profile.scatter(fitted_drop.residuals, fitted_drop.residuals, s=80, facecolors='none', edgecolors='b')
 
     def update_residual_plot(self, experimental_drop, fitted_drop):
-        n_points = len(fitted_drop.residuals)
+        self.draw_residual_plot(*self.residual_plot_data(experimental_drop, fitted_drop))
 
-        if self.residual_initialised == False:
-            self.setup_residual_plot(n_points) #fitted_drop)
-            self.residual_initialised = True
+    # residuals against the arc length, signed by the side of the drop
+    def residual_plot_data(self, experimental_drop, fitted_drop):
         # self.residual_data.set_xdata(fitted_drop.arc_lengths)
         # self.residual_data.set_xdata(fitted_drop.residuals)
         # self.residual_data.set_ydata(fitted_drop.residuals)
-        
-        
         x_apex = fitted_drop.params[0]
         # self.residual_data.set_xdata([math.copysign(fitted_drop.arc_lengths[i], experimental_drop.drop_data[i,0] - x_apex) for i in range(n_points)])
         # self.residual_data.set_ydata([math.copysign(fitted_drop.residuals[i], 1) for i in range(n_points)]) # inside_outside(i)
-        x_data = [math.copysign(fitted_drop.arc_lengths[i], experimental_drop.drop_data[i,0] - x_apex) for i in range(n_points)]
+        x_data = np.copysign(fitted_drop.arc_lengths, experimental_drop.drop_data[:,0] - x_apex)
         # fitted_drop.signed_arc_lengths
-        self.residual_data.set_xdata(x_data)
-        self.residual_data.set_ydata(fitted_drop.residuals)
+        return x_data, np.array(fitted_drop.residuals)
+
+    def draw_residual_plot(self, x_data, residuals):
+        if self.residual_initialised == False:
+            self.setup_residual_plot(len(residuals)) #fitted_drop)
+            self.residual_initialised = True
+        self.residual_data.set_data(x_data, residuals)
         self.residual_data.axes.relim()
         self.residual_data.axes.autoscale_view(True,True,True)
         self.fig_residual.canvas.draw()
@@ -101,8 +144,12 @@ class FittingPlots(object):
     # def generate_profile(fitted_drop):
     def update_profile_plot(self, experimental_drop, fitted_drop):
         if self.profile_initialised == False:
-                self.setup_profile_plot(experimental_drop, fitted_drop)
+                self.setup_profile_plot(experimental_drop.image, fitted_drop.s_points+1)
                 self.profile_initialised = True
+        self.draw_profile_plot(*self.profile_plot_data(fitted_drop))
+
+    # the fitted profile in image coordinates, as (x, y) of the left and right sides
+    def profile_plot_data(self, fitted_drop):
         # x_apex, y_apex, radius_apex, bond_number, omega_rotation = fitted_drop.params
         x_apex, y_apex, radius_apex, bond_number, omega_rotation = fitted_drop.previous_params
         rotation_matrix = [[cos(omega_rotation), -sin(omega_rotation)], [sin(omega_rotation), cos(omega_rotation)]]
@@ -119,11 +166,11 @@ class FittingPlots(object):
         drop_y_left = y_apex + radius_apex * profile_left[:, 1]
         drop_x_right = x_apex + radius_apex * profile_right[:, 0]
         drop_y_right = y_apex + radius_apex * profile_right[:, 1]
+        return drop_x_left, drop_y_left, drop_x_right, drop_y_right
 
-        self.profile_line_left.set_xdata(drop_x_left)
-        self.profile_line_left.set_ydata(drop_y_left)
-        self.profile_line_right.set_xdata(drop_x_right)
-        self.profile_line_right.set_ydata(drop_y_right)
+    def draw_profile_plot(self, drop_x_left, drop_y_left, drop_x_right, drop_y_right):
+        self.profile_line_left.set_data(drop_x_left, drop_y_left)
+        self.profile_line_right.set_data(drop_x_right, drop_y_right)
 
         self.fig_profile.canvas.draw()
 
@@ -10,7 +10,10 @@ import numpy as np
 PAD = 0.1
 
 class PlotManager(object):
-    def __init__(self, wait_time, n_frames):
+    # with a plot_process (see plot_process.py) the plot is drawn by that process
+    def __init__(self, wait_time, n_frames, plot_process=None):
+        self.wait_time = wait_time
+        self.plot_process = plot_process
         self.max_time = wait_time * n_frames
         self.time_values = np.zeros(n_frames)
         self.IFT_values = np.zeros(n_frames)
@@ -44,6 +47,22 @@ class PlotManager(object):
     def append_data_plot(self, data_vector, position):
         self.append_data(data_vector, position)
         self.check_plot_axes(data_vector)
+        if self.plot_process is not None:
+            self.send_plot()
+        else:
+            self.update_plot()
+
+    # sends all the values so far, the plot process only draws the latest snapshot
+    def send_plot(self):
+        snapshot = {'frames': (self.wait_time, len(self.time_values)),
+                    'values': (self.time_values.copy(), self.IFT_values.copy(),
+                               self.volume_values.copy(), self.area_values.copy())}
+        self.plot_process.send('time_series', snapshot, force=True)
+
+    # draws a snapshot made by send_plot (in the plot process)
+    def draw_snapshot(self, snapshot):
+        self.time_values, self.IFT_values, self.volume_values, self.area_values = snapshot['values']
+        self.axes_update = True
         self.update_plot()
 
 
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+#coding=utf-8
+from __future__ import print_function
+from classes import ExperimentalDrop
+from read_image import get_image
+
+import threading
+import Queue
+import timeit
+
+# live frames are captured on their own thread every wait_time seconds and queued for
+# analysis, so the sampling rate is set by the camera schedule rather than by the fit
+ACQUISITION_QUEUE_SIZE = 4 # captured frames waiting for analysis, newer frames are dropped beyond this
+MISSED_CAPTURE_TOL = 0.1 # scheduled captures not started within this time (s) are skipped, not bunched up
+FRAME_WAIT_TIMEOUT = 0.5 # the analysis waits for frames in steps of this (s), so it can be interrupted
+
+class FrameAcquisition(threading.Thread):
+    def __init__(self, experimental_setup, n_frames, queue_size=ACQUISITION_QUEUE_SIZE):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.experimental_setup = experimental_setup
+        self.n_frames = n_frames
+        self.queue = Queue.Queue(queue_size)
+        self.stopped = threading.Event()
+        self.captured = 0
+        self.dropped = 0
+        self.missed = 0
+        self.max_queue_depth = 0
+
+    # an error stopping the capture is passed on with the end of the frames
+    def run(self):
+        error = None
+        try:
+            self.capture_frames()
+        except Exception as capture_error:
+            error = capture_error
+        finally:
+            self.queue.put((None, error))
+
+    def capture_frames(self):
+        time_start = timeit.default_timer()
+        for i in range(self.n_frames):
+            delay = time_start + i * self.experimental_setup.wait_time - timeit.default_timer()
+            if delay < -MISSED_CAPTURE_TOL:
+                self.missed += 1 # capture of an earlier frame overran this frame's time
+                continue
+            if delay > 0:
+                self.stopped.wait(delay)
+            if self.stopped.is_set():
+                return
+            experimental_drop = ExperimentalDrop()
+            get_image(experimental_drop, self.experimental_setup, i) # time stamped at capture
+            self.captured += 1
+            try:
+                self.queue.put_nowait((i, experimental_drop))
+            except Queue.Full:
+                self.dropped += 1
+                print("WARNING: analysis is %d frames behind, frame %d dropped" % (self.queue.qsize(), i+1))
+            self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+
+    # yields (frame number, captured drop) in capture order until the last frame, raising
+    # the error that stopped the capture, if any
+    def frames(self):
+        while True:
+            try:
+                i, experimental_drop = self.queue.get(timeout=FRAME_WAIT_TIMEOUT)
+            except Queue.Empty:
+                continue
+            if i is None:
+                if experimental_drop is not None:
+                    raise experimental_drop
+                return
+            yield i, experimental_drop
+
+    # ends the capture early (e.g. when the analysis fails) and waits for the thread to finish
+    def stop(self):
+        self.stopped.set()
+        while self.is_alive():
+            try:
+                self.queue.get(timeout=FRAME_WAIT_TIMEOUT) # the end of the frames may be waiting for room
+            except Queue.Empty:
+                pass
+
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def print_summary(self):
+        print("Frames captured: %d, dropped: %d, missed: %d, largest queue depth: %d" % (self.captured,
+              self.dropped, self.missed, self.max_queue_depth))
+
+
+# reads the frames one after the other in the calling thread (e.g. for local images)
+def read_frames(experimental_setup, n_frames):
+    for i in range(n_frames):
+        experimental_drop = ExperimentalDrop()
+        get_image(experimental_drop, experimental_setup, i)
+        yield i, experimental_drop
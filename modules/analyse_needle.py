@@ -4,7 +4,10 @@ from __future__ import print_function
 import numpy as np
 # import cv,cv2
 
+# needle_data is None when the needle has not changed since its diameter was fitted
 def calculate_needle_diameter(raw_experiment, fitted_drop_data, tolerances):
+    if raw_experiment.needle_data is None:
+        return
     # [offset, needle_diameter, theta] = fit_needle(raw_experiment.needle_data, tolerances)
     # fitted_drop_data.needle_diameter = needle_diameter
     # fitted_drop_data.needle_diameter = fit_needle(raw_experiment.needle_data, tolerances)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+#coding=utf-8
+from __future__ import print_function
+from interpolation_function import cubic_interpolation_function
+import numpy as np
+
+# adaptive Dormand--Prince 5(4) integration of many profiles at once
+# http://en.wikipedia.org/wiki/Dormand%E2%80%93Prince_method
+# all profiles share the step size, which is controlled by the least accurate profile
+
+RTOL = 1.49012e-8 # same default tolerances as odeint
+ATOL = 1.49012e-8
+INITIAL_STEP = 1.e-6
+MINIMUM_STEP = 1.e-10
+SAFETY = 0.9
+MAXIMUM_STEP_INCREASE = 5.
+MINIMUM_STEP_DECREASE = 0.2
+
+DP_C = [0., 1./5, 3./10, 4./5, 8./9, 1., 1.]
+DP_A = [[],
+        [1./5],
+        [3./40, 9./40],
+        [44./45, -56./15, 32./9],
+        [19372./6561, -25360./2187, 64448./6561, -212./729],
+        [9017./3168, -355./33, 46732./5247, 49./176, -5103./18656],
+        [35./384, 0., 500./1113, 125./192, -2187./6784, 11./84]]
+DP_B5 = np.array([35./384, 0., 500./1113, 125./192, -2187./6784, 11./84, 0.])
+DP_B4 = np.array([5179./57600, 0., 7571./16695, 393./640, -92097./339200, 187./2100, 1./40])
+DP_E = DP_B5 - DP_B4
+
+# integrates derivative(x_vec, t, bond_number) (e.g. ylderiv or dataderiv) for every
+# Bond number in bond_numbers from x_vec_initial, either one state shared by all profiles
+# or one state per profile (n_bond, n_state), returning an array shaped (n_bond, len(s_data_points), n_state)
+# steps are not tied to s_data_points: output points inside a step are filled by cubic
+# Hermite interpolation from the states and derivatives at both ends of the step
+# profiles that cannot be integrated to the requested accuracy, or (if closure_x is given)
+# that turn back towards the axis below x = closure_x, are filled with nan from there onwards
+def integrate_profiles(derivative, x_vec_initial, s_data_points, bond_numbers, rtol=RTOL, atol=ATOL, closure_x=None):
+    bond_numbers = np.asarray(bond_numbers, dtype=float)
+    n_bond = len(bond_numbers)
+    state = np.array(np.broadcast_to(x_vec_initial, (n_bond, np.shape(x_vec_initial)[-1])), dtype=float)
+    data = np.empty((n_bond, len(s_data_points), state.shape[1]))
+    data[:, 0] = state
+    active = np.ones(n_bond, dtype=bool)
+    s = s_data_points[0]
+    s_end = s_data_points[-1]
+    h = INITIAL_STEP
+    n = 1 # next output point
+    k_first = batch_derivative(derivative, state, s, bond_numbers)
+    while s < s_end:
+        h_step = min(h, s_end - s)
+        state_new, k_last, error = dormand_prince_step(derivative, state, k_first, s, h_step, bond_numbers)
+        scale = atol + rtol * np.maximum(np.abs(state), np.abs(state_new))
+        error_norm = np.sqrt(np.mean((error / scale)**2, axis=1))
+        error_norm[~active] = 0.
+        error_norm[~np.isfinite(error_norm)] = np.inf
+        if (error_norm.max() > 1) and (h_step > MINIMUM_STEP):
+            h = h_step * max(MINIMUM_STEP_DECREASE, SAFETY * error_norm.max()**(-0.2))
+            continue
+        # at the minimum step, give up on the profiles that still fail
+        active &= (error_norm <= 1)
+        if closure_x is not None: # stop profiles closing back onto the axis, which need tiny steps
+            with np.errstate(invalid='ignore'):
+                active &= ~((state_new[:, 0] < closure_x) & (k_last[:, 0] < 0))
+        state_new[~active] = np.nan
+        k_last[~active] = np.nan
+        s_new = s + h_step
+        while (n < len(s_data_points)) and (s_data_points[n] <= s_new):
+            t = (s_data_points[n] - s) / h_step
+            data[:, n] = cubic_interpolation_function(state, state_new, k_first, k_last, h_step, t)
+            n += 1
+        s = s_new
+        state = state_new
+        k_first = k_last
+        worst = max(error_norm.max(), 1.e-10)
+        h = h_step * min(MAXIMUM_STEP_INCREASE, SAFETY * worst**(-0.2))
+    data[:, n:] = state[:, np.newaxis] # output points within rounding of s_end
+    return data
+
+# takes one step of size h from s, returning the new state, its derivative and the error estimate
+def dormand_prince_step(derivative, state, k_first, s, h, bond_numbers):
+    k = [k_first]
+    for stage in range(1, 7):
+        increment = sum(a * k_i for a, k_i in zip(DP_A[stage], k) if a != 0.)
+        k.append(batch_derivative(derivative, state + h * increment, s + DP_C[stage] * h, bond_numbers))
+    state_new = state + h * sum(b * k_i for b, k_i in zip(DP_B5, k) if b != 0.)
+    error = h * sum(e * k_i for e, k_i in zip(DP_E, k))
+    return state_new, k[-1], error
+
+# evaluates the scalar right hand side on the (n_bond, n_state) array state
+def batch_derivative(derivative, state, s, bond_numbers):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.array(derivative(state.T, s, bond_numbers)).T
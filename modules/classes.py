@@ -2,13 +2,15 @@
 # coding=utf-8
 from de_YoungLaplace import ylderiv
 from de_YoungLaplace import dataderiv
+from de_YoungLaplace import solve_from_apex
+from de_YoungLaplace import apex_series_derivative
+from de_YoungLaplace import APEX_SERIES_S
 from interpolation_function import cubic_interpolation_function
-from scipy.integrate import odeint
 
 import numpy as np
 
 class Tolerances(object):
-    def __init__(self, delta_tol, gradient_tol, maximum_fitting_steps, objective_tol, arclength_tol, maximum_arclength_steps, needle_tol, needle_steps):
+    def __init__(self, delta_tol, gradient_tol, maximum_fitting_steps, objective_tol, arclength_tol, maximum_arclength_steps, needle_tol, needle_steps, decimation_points=(), decimation_delta_tol=1.e-4):
         self.DELTA_TOL = delta_tol
         self.GRADIENT_TOL = gradient_tol
         self.MAXIMUM_FITTING_STEPS = maximum_fitting_steps
@@ -17,6 +19,8 @@ class Tolerances(object):
         self.MAXIMUM_ARCLENGTH_STEPS = maximum_arclength_steps
         self.NEEDLE_TOL = needle_tol
         self.NEEDLE_STEPS = needle_steps
+        self.DECIMATION_POINTS = decimation_points # point budget of each coarse fitting stage
+        self.DECIMATION_DELTA_TOL = decimation_delta_tol # parameter tolerance of the coarse stages
 
 
 # class ExperimentalSetup(object):
@@ -50,6 +54,12 @@ class ExperimentalSetup(object):
         self.time_string = None
         self.local_files = None
         self.constant_volume_boole = None
+        self.fitting_method = None
+        self.plot_process = None
+        self.video_capture = None
+        self.file_source = None
+        self.camera_source = None
+        self.image_archiver = None
 
 class ExperimentalDrop(object):
     def __init__(self):
@@ -73,14 +83,31 @@ class DropData(object):
         self._params = None
         self._max_s = None
         self._s_points = 200
-        self.theoretical_data = None
+        self._theoretical_data = None
+        self._derivative_data = None
+        self._profile_stale = False # profile is regenerated when first read after a change
+        self.profile_library = None # optional ProfileLibrary serving interpolated profiles
+        self.profile_integrations = 0 # number of profiles integrated with odeint
+        self.profile_library_lookups = 0 # number of profiles interpolated from the library
+        self.max_s_expansions = 0 # number of times profile() had to expand max_s
         self.parameter_dimensions = 5
         self.residuals = None
         self.arc_lengths = None
         # self.fitted = False
+        self.converged = False # whether the last fit stopped before the maximum number of steps
+        self.objective_function = None # mean squared residual of the last fit
         self.needle_diameter_pixels = None
         self.s_left = None
         self.s_right = None
+        self.unconverged_points = None # indices of points whose arc length search did not converge
+        self.contour_extent = None # extent of the contour the parameters were initialised for
+        self.previous_extent = None # extent of the contour of the last fitted frame
+        self.arc_length_cache = None # arc lengths of the closest points from the last Jacobian evaluation
+        self.arc_length_cache_points = None # the data points those arc lengths belong to
+        self.arc_length_cache_params = None # and the parameters they were found for
+        self.arc_length_cache_scaled = None # the data points relative to the apex, scaled by the apex radius
+        self.tracked_edges = None # drop edge and threshold of the last frame, to track the drop edge from
+        self.needle_reference = None # needle region pixels along the needle edges when they were last detected
         # self.s_0 = None
         # self.start_time = None
         # # self.rho_drop = None
@@ -97,23 +124,25 @@ class DropData(object):
         # self.wait_time = None
 
 
-    # interpolates the theoretical profile data
+    # interpolates the theoretical profile data at the arc length(s) s
+    # returns a vector of length 6 for a single s, or an (N, 6) array for an array of N values
     def profile(self, s):
-        if (s < 0):
+        s_values = np.asarray(s, dtype=float)
+        if (s_values < 0).any():
             raise ValueError("s value outside domain")
-        if (s > self.max_s):
+        s_maximum = s_values.max()
+        if (s_maximum > self.max_s):
             # if the profile is called outside of the current region, expand
-            self.max_s = 1.2 * s # expand region to include s_max
+            self.max_s = 1.2 * s_maximum # expand region to include s_max
+            self.max_s_expansions += 1
+        theoretical_data = self.theoretical_data
+        derivative_data = self.derivative_data
         Delta_s = self.max_s / self.s_points
-        n1 = int(s / Delta_s)
+        n1 = np.minimum((s_values / Delta_s).astype(int), self.s_points - 1)
         n2 = n1 + 1
-        t =  s / Delta_s - n1
-        vec1 = np.array(self.theoretical_data[n1])
-        vec2 = np.array(self.theoretical_data[n2])
-        bond_number = self.bond()
-        Dvec1 = np.array(ylderiv(vec1, 0, bond_number))
-        Dvec2 = np.array(ylderiv(vec2, 0, bond_number))
-        value_at_s = cubic_interpolation_function(vec1, vec2, Dvec1, Dvec2, Delta_s, t)
+        t = (s_values / Delta_s - n1)[..., np.newaxis]
+        value_at_s = cubic_interpolation_function(theoretical_data[n1], theoretical_data[n2],
+                                                  derivative_data[n1], derivative_data[n2], Delta_s, t)
         return value_at_s
 
     # generates a new drop profile
@@ -123,10 +152,21 @@ class DropData(object):
             # self.fitted = False
             # s_data_points = np.arange(0, self.max_s*(1+2/self.s_points), self.max_s/self.s_points)
             s_data_points = np.linspace(0, self.max_s, self.s_points + 1)
-            # EPS = .000001 # need to use Bessel function Taylor expansion below
-            x_vec_initial = [.000001, 0., 0., 0., 0., 0.]
             bond_number = self.bond()
-            self.theoretical_data = odeint(ylderiv, x_vec_initial, s_data_points, args=(bond_number,))
+            theoretical_data = None
+            if self.profile_library is not None:
+                theoretical_data = self.profile_library.profile_data(bond_number, s_data_points)
+            if theoretical_data is None: # not covered by the profile library
+                theoretical_data = solve_from_apex(ylderiv, s_data_points, bond_number)
+                self.profile_integrations += 1
+            else:
+                self.profile_library_lookups += 1
+            self._theoretical_data = theoretical_data
+            # derivatives at the tabulated points used as slopes by the cubic interpolation
+            self._derivative_data = np.array(ylderiv(theoretical_data.T, 0, bond_number)).T
+            series_points = s_data_points <= APEX_SERIES_S # sin(phi)/x is inaccurate near the apex
+            self._derivative_data[series_points] = apex_series_derivative(s_data_points[series_points], bond_number)
+            self._profile_stale = False
 
     # # generates a new drop profile
     # def generate_profile_volume_area_data(self):
@@ -154,7 +194,27 @@ class DropData(object):
     #     return 100
 
 
-    # generate new profile when params are changed
+    # the theoretical profile, regenerated on first read after it has been marked stale
+    @property
+    def theoretical_data(self):
+        if self._profile_stale:
+            self.generate_profile_data()
+        return self._theoretical_data
+
+    # the derivatives of the theoretical profile with respect to arc length
+    @property
+    def derivative_data(self):
+        if self._profile_stale:
+            self.generate_profile_data()
+        return self._derivative_data
+
+    # resets the profile generation counters (e.g. at the start of each frame)
+    def reset_profile_counters(self):
+        self.profile_integrations = 0
+        self.profile_library_lookups = 0
+        self.max_s_expansions = 0
+
+    # mark profile as stale when the Bond number is changed
     @property
     def params(self):
         return self._params
@@ -163,10 +223,11 @@ class DropData(object):
     def params(self, vector):
         if len(vector) != self.parameter_dimensions:
             raise ValueError("Parameter array incorrect dimensions")
+        if (self._params is None) or (vector[3] != self._params[3]):
+            self._profile_stale = True # the scaled profile only depends on the Bond number
         self._params = vector
-        self.generate_profile_data() # generate new profile when the parameters are changed
 
-    # generate new profile when max_s is changed
+    # mark profile as stale when max_s is changed
     @property
     def max_s(self):
         return self._max_s
@@ -176,9 +237,9 @@ class DropData(object):
         if value <= 0:
             raise ValueError("Maximum arc length must be positive")
         self._max_s = float(value)
-        self.generate_profile_data() # generate new profile when the maximum arc length is changed
+        self._profile_stale = True # regenerate profile when the maximum arc length is changed
 
-    # test validity of variable s_points + generate new profile when s_points are
+    # test validity of variable s_points + mark profile as stale when s_points are changed
     @property
     def s_points(self):
         return self._s_points
@@ -190,7 +251,7 @@ class DropData(object):
         if not isinstance(value, int):
             raise ValueError("Number of points must be an integer")
         self._s_points = value
-        self.generate_profile_data() # generate new profile when the maximum arc length is changed
+        self._profile_stale = True # regenerate profile when the number of points is changed
 
     # def calculate_interfacial_tension(self):
     #     if self.fitted:
@@ -3,6 +3,13 @@
 
 from math import pi
 from numpy import sin, cos
+from scipy.integrate import odeint
+import numpy as np
+
+APEX_SERIES_S = 0.1 # arc length up to which the apex power series replaces integration
+APEX_X = .000001 # x at s = 0, keeps sin(phi)/x finite at the apex
+YL_COMPONENTS = [0, 1, 2, 3, 4, 5] # series components matching ylderiv
+DATA_COMPONENTS = [0, 1, 2, 6, 7] # series components matching dataderiv
 
 # minimise calls to sin() and cos()
 # defines the Young--Laplace system of differential equations to be solved
@@ -26,6 +33,46 @@ def dataderiv(x_vec, t, bond_number):
     sur_s = 2 * pi * x
     return [x_s, y_s, phi_s, vol_s, sur_s]
 
+# power series solution of the Young--Laplace equation about the apex, where sin(phi)/x is singular
+# returns the coefficients of s^0 ... s^8 for x, y, phi, x_Bond, y_Bond, phi_Bond, vol, sur
+def apex_series_coefficients(bond_number):
+    B = bond_number
+    coefficients = np.zeros((8, 9))
+    coefficients[0, [1, 3, 5, 7]] = [1., -1./6, (3*B + 1)/120., -(75*B**2 + 144*B + 8)/40320.]
+    coefficients[1, [2, 4, 6, 8]] = [0.5, -(3*B + 4)/96., (5*B**2 + 64*B + 8)/5760., -(35*B**3 + 3624*B**2 + 2440*B + 64)/2580480.]
+    coefficients[2, [1, 3, 5, 7]] = [1., -B/8., B*(5*B + 4)/960., -B*(35*B**2 + 264*B + 88)/322560.]
+    # Bond number sensitivities are the derivatives of the above with respect to B
+    coefficients[3, [5, 7]] = [3./120, -(150*B + 144)/40320.]
+    coefficients[4, [4, 6, 8]] = [-3./96, (10*B + 64)/5760., -(105*B**2 + 7248*B + 2440)/2580480.]
+    coefficients[5, [3, 5, 7]] = [-1./8, (10*B + 4)/960., -(105*B**2 + 528*B + 88)/322560.]
+    coefficients[6, [4, 6, 8]] = [pi/4, -pi*(B/48. + 1./12), pi*(B**2/1536. + 19*B/960. + 13./960)]
+    coefficients[7, [2, 4, 6, 8]] = [pi, -pi/12, pi*(B/120. + 1./360), -pi*(5*B**2/10752. + B/1120. + 1./20160)]
+    return coefficients
+
+# evaluates the apex series at the arc lengths s, returns an (N, len(components)) array
+def apex_series(s, bond_number, components=YL_COMPONENTS):
+    coefficients = apex_series_coefficients(bond_number)[components]
+    return np.polynomial.polynomial.polyval(s, coefficients.T).T
+
+# evaluates the arc length derivative of the apex series at the arc lengths s
+def apex_series_derivative(s, bond_number, components=YL_COMPONENTS):
+    coefficients = apex_series_coefficients(bond_number)[components]
+    return np.polynomial.polynomial.polyval(s, np.polynomial.polynomial.polyder(coefficients.T)).T
+
+# solves derivative (ylderiv or dataderiv) at s_data_points, which start at s = 0
+# points up to APEX_SERIES_S are taken from the apex series, the rest is integrated from there
+def solve_from_apex(derivative, s_data_points, bond_number, components=YL_COMPONENTS):
+    s_series = min(APEX_SERIES_S, s_data_points[-1])
+    series_points = s_data_points <= s_series
+    data = np.empty((len(s_data_points), len(components)))
+    data[series_points] = apex_series(s_data_points[series_points], bond_number, components)
+    if not series_points.all():
+        s_integrate = np.concatenate(([s_series], s_data_points[~series_points]))
+        x_vec_initial = apex_series(s_series, bond_number, components)
+        data[~series_points] = odeint(derivative, x_vec_initial, s_integrate, args=(bond_number,))[1:]
+    data[0, 0] = APEX_X
+    return data
+
 # # defines the Young--Laplace system of differential equations to be solved
 # def ylderiv(x_vec, t):
 #     x, y, phi, x_Bond, y_Bond, phi_Bond = x_vec
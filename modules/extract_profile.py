@@ -7,17 +7,41 @@ import cv2
 # import datetime
 
 BLUR_SIZE = 3
-VERSION_CV2 = cv2.__version__
+TRACK_EDGES = False # look for each frame's drop edge near the previous frame's before searching the whole region (only faster when the region is much larger than the drop)
+TRACKING_BAND = 20 # pixels the drop edge may move between frames and still be tracked
+TRACKING_LENGTH_TOL = 0.2 # tracking is lost when the edges found change length by more than this fraction
+CALIBRATE_NEEDLE = True # keep the threshold and needle diameter until the needle region changes
+NEEDLE_DRIFT_TOL = 2 # mean change (grey levels) along either needle edge that counts as a change
+SUBPIXEL_EDGES = False # move each edge pixel to the gradient maximum along the gradient direction
+PROFILE_POINTS = None # number of drop profile points, evenly spaced in arc length (None keeps every edge pixel)
 
-def extract_drop_profile(raw_experiment, user_inputs):
-    profile_crop = image_crop(raw_experiment.image, user_inputs.drop_region)
-    # profile_edges = detect_edges(profile_crop, raw_experiment, user_inputs.drop_region)
-    # profile, raw_experiment.ret = detect_edges(profile_crop, raw_experiment, user_inputs.drop_region)
-    profile, raw_experiment.ret = detect_edges(profile_crop, raw_experiment, user_inputs.drop_region, -1, 1)
-    raw_experiment.drop_data = profile[0]
+# with drop_data (the fit carried over from the previous frame) the needle is only detected
+# again when the pixels along its edges have changed, otherwise needle_data is None and the
+# threshold and needle diameter are kept, and the drop edge is first looked for in the band
+# around the previous frame's, falling back to the whole region when it is not found there
+def extract_drop_profile(raw_experiment, user_inputs, drop_data=None):
+    needle_unchanged = (drop_data is not None) and needle_calibrated(raw_experiment, user_inputs, drop_data)
+    if not (needle_unchanged and track_drop_profile(raw_experiment, user_inputs, drop_data)):
+        ret = drop_data.tracked_edges[1] if needle_unchanged else -1
+        profile_crop = image_crop(raw_experiment.image, user_inputs.drop_region)
+        # profile_edges = detect_edges(profile_crop, raw_experiment, user_inputs.drop_region)
+        # profile, raw_experiment.ret = detect_edges(profile_crop, raw_experiment, user_inputs.drop_region)
+        profile, raw_experiment.ret = detect_edges(profile_crop, raw_experiment, user_inputs.drop_region, ret, 1)
+        raw_experiment.drop_data = profile[0]
 
-    needle_crop = image_crop(raw_experiment.image, user_inputs.needle_region)
-    raw_experiment.needle_data, ret = detect_edges(needle_crop, raw_experiment, user_inputs.needle_region, raw_experiment.ret, 2)
+        if not needle_unchanged:
+            needle_crop = image_crop(raw_experiment.image, user_inputs.needle_region)
+            raw_experiment.needle_data, ret = detect_edges(needle_crop, raw_experiment, user_inputs.needle_region, raw_experiment.ret, 2)
+    if drop_data is not None:
+        drop_data.tracked_edges = [raw_experiment.drop_data, raw_experiment.ret]
+        if not needle_unchanged:
+            drop_data.needle_reference = needle_reference(raw_experiment.image, user_inputs.needle_region, raw_experiment.needle_data)
+    if SUBPIXEL_EDGES:
+        raw_experiment.drop_data = subpixel_edges(raw_experiment.image, raw_experiment.drop_data)
+        if raw_experiment.needle_data is not None:
+            raw_experiment.needle_data = [subpixel_edges(raw_experiment.image, edge) for edge in raw_experiment.needle_data]
+    if PROFILE_POINTS is not None:
+        raw_experiment.drop_data = resample_profile(raw_experiment.drop_data, PROFILE_POINTS)
 
     
 
@@ -25,7 +49,44 @@ def extract_drop_profile(raw_experiment, user_inputs):
     # needle_crop = image_crop(raw_experiment.image, user_inputs.needle_region)
     # raw_experiment.needle_data = detect_edges(needle_crop, user_inputs.needle_region)
 
+# finds the drop edge near the previous frame's with its threshold, returns False if it has
+# been lost (only called while the needle region is unchanged, as otherwise the lighting
+# may have changed and the threshold is found again)
+def track_drop_profile(raw_experiment, user_inputs, drop_data):
+    if (not TRACK_EDGES) or (drop_data.tracked_edges is None):
+        return False
+    previous_drop, ret = drop_data.tracked_edges
+    profile = track_edges(raw_experiment, user_inputs.drop_region, [previous_drop], ret)
+    if profile is None:
+        print("Drop edge lost, searching the whole drop region")
+        return False
+    raw_experiment.drop_data = profile[0]
+    raw_experiment.ret = ret
+    return True
+
+# True if the needle region pixels within two pixels of each needle edge have, on average,
+# changed by no more than NEEDLE_DRIFT_TOL since the needle diameter was fitted
+def needle_calibrated(raw_experiment, user_inputs, drop_data):
+    if (not CALIBRATE_NEEDLE) or (drop_data.needle_reference is None) or (drop_data.needle_diameter_pixels is None):
+        return False
+    needle_crop = image_crop(raw_experiment.image, user_inputs.needle_region)
+    for rows, columns, values in drop_data.needle_reference:
+        if abs(np.mean(needle_crop[rows, columns] - values)) > NEEDLE_DRIFT_TOL:
+            print("Needle region changed, finding the threshold and needle diameter again")
+            return False
+    return True
 
+# the needle region pixels within two pixels of each of the needle edges, and their values
+def needle_reference(image, points, needle_data):
+    needle_crop = image_crop(image, points)
+    reference = []
+    for edge in needle_data:
+        pixels = pixel_coordinates(edge, image.shape[0], points[0])
+        mask = np.zeros(needle_crop.shape[:2], np.uint8)
+        mask[pixels[:,1], pixels[:,0]] = 1
+        rows, columns = np.nonzero(cv2.dilate(mask, np.ones((5, 5), np.uint8)))
+        reference.append((rows, columns, needle_crop[rows, columns].astype(float)))
+    return reference
 
 def image_crop(image, points):
     # return image[points[0][0]:points[0][1], points[1][0]:points[1][1]]
@@ -52,10 +113,8 @@ def detect_edges(image, raw_experiment, points, ret, n_contours):
     # error in PDT code - shouldn't threshold before Canny - otherwise Canny is useless
     edges = cv2.Canny(blur,0.5*ret,ret) # detect edges using Canny edge detection
 
-    if float(VERSION_CV2[0]) > 2: #Version 3 of opencv returns an extra argument
-        _,contours, hierarchy = cv2.findContours(edges,cv2.RETR_TREE,cv2.CHAIN_APPROX_NONE)
-    else:
-        contours, hierarchy = cv2.findContours(edges,cv2.RETR_TREE,cv2.CHAIN_APPROX_NONE)
+    # OpenCV 3 returns an extra argument first
+    contours = cv2.findContours(edges,cv2.RETR_TREE,cv2.CHAIN_APPROX_NONE)[-2]
 
     contour_lengths = [] #list to hold all areas
 
@@ -67,16 +126,136 @@ def detect_edges(image, raw_experiment, points, ret, n_contours):
     indexed_contours_to_return = indexed_contour_lengths[:n_contours]
 
     image_height = raw_experiment.image.shape[0]
-    offset = [points[0][0], image_height - points[0][1]]
-    points = []
-    for index in indexed_contours_to_return:
-        current_contour = contours[index][:,0]
-        for i in range(current_contour.shape[0]):
-            current_contour[i,1] = - current_contour[i,1]
-            current_contour[i,:] = current_contour[i,:] + offset
-        points.append(current_contour[current_contour[:,1].argsort()])
+    points = [profile_coordinates(contours[index][:,0], image_height, points[0]) for index in indexed_contours_to_return]
 
     return points, ret
+
+# converts contour pixels of the crop with top-left pixel origin to float (x, y) data where
+# (0, 0) is the lower-left pixel of the image, sorted by height - an (N x 2) contiguous array,
+# as the fit uses it
+def profile_coordinates(contour, image_height, origin):
+    offset = np.array([origin[0], image_height - origin[1]], dtype=float)
+    contour = contour * np.array([1., -1.]) + offset
+    return np.ascontiguousarray(contour[contour[:,1].argsort()])
+
+# the inverse of profile_coordinates, as integer pixels of the crop with top-left pixel origin
+def pixel_coordinates(profile, image_height, origin):
+    pixels = np.rint(profile).astype(int)
+    return np.column_stack((pixels[:,0] - origin[0], image_height - origin[1] - pixels[:,1]))
+
+# detects the edges of the region points (with threshold ret) in the band TRACKING_BAND pixels
+# either side of the previous contours, returning the longest edge near each (as profile data),
+# or None if any of them has not been found, has moved by more than TRACKING_BAND or has
+# changed length by more than TRACKING_LENGTH_TOL
+def track_edges(raw_experiment, points, previous_contours, ret):
+    image_height = raw_experiment.image.shape[0]
+    region = image_crop(raw_experiment.image, points)
+    previous_pixels = [pixel_coordinates(contour, image_height, points[0]) for contour in previous_contours]
+    all_pixels = np.concatenate(previous_pixels)
+    x_min, y_min = np.maximum(all_pixels.min(axis=0) - TRACKING_BAND, 0)
+    x_max, y_max = np.minimum(all_pixels.max(axis=0) + TRACKING_BAND + 1, region.shape[1::-1])
+    if (x_max <= x_min) or (y_max <= y_min):
+        return None
+    image = region[y_min:y_max, x_min:x_max]
+    if len(image.shape) != 2:
+        image = cv2.cvtColor(image,cv2.COLOR_BGR2GRAY)
+    blur = cv2.GaussianBlur(image,(BLUR_SIZE,BLUR_SIZE),0)
+    edges = cv2.Canny(blur,0.5*ret,ret)
+    # the band is drawn as thick lines along each side of the previous contours, through
+    # points about half a band width apart
+    band = np.zeros(edges.shape, np.uint8)
+    for previous, pixels in zip(previous_contours, previous_pixels):
+        lines = []
+        for side, arc_lengths in profile_sides(previous, previous[0,0]):
+            if len(side) > 0:
+                vertices = np.unique(np.searchsorted(arc_lengths, np.arange(0, arc_lengths[-1] + TRACKING_BAND, 0.5 * TRACKING_BAND)).clip(0, len(side) - 1))
+                lines.append((pixels[side[vertices]] - [x_min, y_min]).astype(np.int32))
+        cv2.polylines(band, lines, False, 255, 2 * TRACKING_BAND + 1)
+    edges = cv2.bitwise_and(edges, band)
+    # edges inside a closed contour are never the longest, so only the outermost are needed
+    contours = cv2.findContours(edges,cv2.RETR_EXTERNAL,cv2.CHAIN_APPROX_NONE)[-2]
+    candidates = sorted(range(len(contours)), key=lambda index: len(contours[index]), reverse=True)[:len(previous_contours)]
+    if len(candidates) < len(previous_contours):
+        return None
+
+    tracked = []
+    for previous, pixels in zip(previous_contours, previous_pixels):
+        pixels = pixels - [x_min, y_min]
+        # the contour whose extent is closest to the previous contour's
+        extents = [np.concatenate((contours[index][:,0].min(axis=0), contours[index][:,0].max(axis=0))) for index in candidates]
+        shifts = [np.abs(extent - np.concatenate((pixels.min(axis=0), pixels.max(axis=0)))).max() for extent in extents]
+        closest = int(np.argmin(shifts))
+        index = candidates.pop(closest)
+        if (shifts[closest] > TRACKING_BAND) or (abs(len(contours[index]) - len(previous)) > TRACKING_LENGTH_TOL * len(previous)):
+            return None
+        tracked.append(index)
+    # longest first and otherwise in the order found, as detect_edges returns them
+    tracked = [contours[index] for index in sorted(tracked)]
+    indexed_contour_lengths = np.array([cv2.arcLength(contour,0) for contour in tracked]).argsort()[::-1]
+    origin = (points[0][0] + x_min, points[0][1] + y_min)
+    return [profile_coordinates(tracked[index][:,0], image_height, origin) for index in indexed_contour_lengths]
+
+# refines the edge pixels of profile (profile data, as returned by detect_edges) to the maximum
+# of the gradient magnitude of the blurred image, by fitting a parabola through the magnitude
+# at the pixel and one pixel either side along the gradient direction, returning each edge
+# pixel once (contours trace thin edges on both sides)
+def subpixel_edges(image, profile):
+    image_height = image.shape[0]
+    pixels = pixel_coordinates(np.unique(profile, axis=0), image_height, (0, 0))
+    x_min, y_min = np.maximum(pixels.min(axis=0) - BLUR_SIZE, 0)
+    x_max, y_max = np.minimum(pixels.max(axis=0) + BLUR_SIZE + 1, image.shape[1::-1])
+    image = image[y_min:y_max, x_min:x_max]
+    if len(image.shape) != 2:
+        image = cv2.cvtColor(image,cv2.COLOR_BGR2GRAY)
+    blur = cv2.GaussianBlur(image.astype(np.float32),(BLUR_SIZE,BLUR_SIZE),0)
+    gradient_x = cv2.Sobel(blur,cv2.CV_32F,1,0)
+    gradient_y = cv2.Sobel(blur,cv2.CV_32F,0,1)
+    magnitude = cv2.magnitude(gradient_x, gradient_y)
+
+    pixels = pixels - [x_min, y_min]
+    x = pixels[:,0]
+    y = pixels[:,1]
+    magnitude_0 = magnitude[y, x]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        normal_x = np.nan_to_num(gradient_x[y, x] / magnitude_0)
+        normal_y = np.nan_to_num(gradient_y[y, x] / magnitude_0)
+    # magnitudes one pixel either side along the gradient, bilinearly interpolated
+    map_x = np.concatenate((x - normal_x, x + normal_x)).astype(np.float32).reshape(-1, 1)
+    map_y = np.concatenate((y - normal_y, y + normal_y)).astype(np.float32).reshape(-1, 1)
+    magnitude_minus, magnitude_plus = np.split(cv2.remap(magnitude, map_x, map_y, cv2.INTER_LINEAR,
+                                                         borderMode=cv2.BORDER_REPLICATE)[:,0], 2)
+    curvature = magnitude_minus - 2 * magnitude_0 + magnitude_plus
+    with np.errstate(invalid='ignore', divide='ignore'):
+        shift = np.where(curvature < 0, 0.5 * (magnitude_minus - magnitude_plus) / curvature, 0.)
+    shift = np.clip(shift, -0.5, 0.5)
+
+    edges = np.column_stack((x + x_min + shift * normal_x, image_height - (y + y_min + shift * normal_y)))
+    return np.ascontiguousarray(edges[edges[:,1].argsort()])
+
+# splits profile data at x_apex into its two sides, returning for each side the indices of
+# its points in order along the side from the apex (by height, then distance from the apex
+# line), and the arc lengths of those points from the first
+def profile_sides(profile, x_apex):
+    sides = []
+    for side in [np.where(profile[:,0] < x_apex)[0], np.where(profile[:,0] >= x_apex)[0]]:
+        side = side[np.lexsort((np.abs(profile[side,0] - x_apex), profile[side,1]))]
+        arc_lengths = np.concatenate(([0.], np.cumsum(np.hypot(*np.diff(profile[side], axis=0).T))))
+        sides.append((side, arc_lengths))
+    return sides
+
+# returns n_points of profile (sorted by height) evenly spaced in arc length along each side
+# of the lowest point (the apex), linearly interpolated between the profile points
+def resample_profile(profile, n_points):
+    unique_profile = np.unique(profile, axis=0)
+    sides = [(unique_profile[side], arc_lengths) for side, arc_lengths in profile_sides(unique_profile, profile[0,0]) if len(side) > 1]
+    total_length = sum(arc_lengths[-1] for side, arc_lengths in sides)
+    resampled = []
+    for side, arc_lengths in sides:
+        n_side = max(2, int(round(n_points * arc_lengths[-1] / total_length)))
+        s = np.linspace(0, arc_lengths[-1], n_side)
+        resampled.append(np.column_stack((np.interp(s, arc_lengths, side[:,0]), np.interp(s, arc_lengths, side[:,1]))))
+    resampled = np.concatenate(resampled)
+    return np.ascontiguousarray(resampled[resampled[:,1].argsort(kind='mergesort')])
     # points = largest_contour[largest_contour[:,1].argsort()]
 
  
@@ -1,19 +1,62 @@
 #!/usr/bin/env python
 #coding=utf-8
 from __future__ import print_function
+import copy
 import numpy as np
+import scipy.linalg
 from jacobian import rowJacobian
+from jacobian import batch_jacobian
 from FittingPlots import FittingPlots
+from extract_profile import profile_sides
 
 np.set_printoptions(suppress=True)
 np.set_printoptions(precision=3)
 
 dot = np.dot
 
+BATCH_JACOBIAN = True # False assembles A and v point by point (original scalar path)
+
+FITTING_METHODS = ["Levenberg--Marquardt--Fletcher", "Trust region"]
+TRUST_REGION_MU = 1.e-3 # damping after the first rejected step, relative to diag(A)
+REDUCTION_TOL = 1.e-9 # smallest relative reduction of the objective worth a step
+GEODESIC_ACCELERATION = False # second order correction, costs one residual evaluation per step
+GEODESIC_STEP = 0.1 # finite difference step for the second directional derivative
+GEODESIC_ALPHA = 0.75 # maximum ratio of the acceleration to the step
+
+# fits the drop with the method selected in user_inputs (Levenberg--Marquardt--Fletcher by default)
+# first on contours decimated to each of tolerances.DECIMATION_POINTS, then on all points
+def fit_experimental_drop(experimental_drop, drop_data, user_inputs, tolerances):
+    if user_inputs.fitting_method == FITTING_METHODS[1]:
+        fit_method = fit_trust_region
+    else:
+        fit_method = fit_fletcher
+    coarse_tolerances = copy.copy(tolerances)
+    coarse_tolerances.DELTA_TOL = tolerances.DECIMATION_DELTA_TOL
+    for n_points in tolerances.DECIMATION_POINTS:
+        if n_points < len(experimental_drop.drop_data):
+            coarse_drop = copy.copy(experimental_drop)
+            coarse_drop.drop_data = decimate_contour(experimental_drop.drop_data, drop_data.params[0], n_points)
+            print("Fitting %d of %d points" % (len(coarse_drop.drop_data), len(experimental_drop.drop_data)))
+            fit_method(coarse_drop, drop_data, user_inputs, coarse_tolerances)
+    fit_method(experimental_drop, drop_data, user_inputs, tolerances)
+
+# returns about n_points of the contour, evenly spaced in arc length along each side of the drop
+# (the contour is sorted by height, which is the order along each side from the apex)
+def decimate_contour(xy_data, x_apex, n_points):
+    indices = []
+    for side, arc_lengths in profile_sides(xy_data, x_apex):
+        if len(side) < 2:
+            indices.append(side)
+            continue
+        n_side = max(2, int(round(n_points * len(side) / float(len(xy_data)))))
+        indices.append(side[np.unique(np.searchsorted(arc_lengths, np.linspace(0, arc_lengths[-1], n_side)))])
+    indices = np.concatenate(indices)
+    return xy_data[indices[xy_data[indices, 1].argsort(kind='mergesort')]]
+
 # implements the Levenberg--Marquardt--Fletcher algorithm to find parameters
 # Levenberg--Marquardt--Fletcher Automated Optimisation
-def fit_experimental_drop(experimental_drop, drop_data, user_inputs, tolerances):
-    fitting_plots = FittingPlots()
+def fit_fletcher(experimental_drop, drop_data, user_inputs, tolerances):
+    fitting_plots = FittingPlots(user_inputs.plot_process)
     degrees_of_freedom = len(experimental_drop.drop_data) - drop_data.parameter_dimensions + 1
     RHO = 0.25
     SIGMA = 0.75
@@ -64,7 +107,86 @@ def fit_experimental_drop(experimental_drop, drop_data, user_inputs, tolerances)
         fitting_plots.update_plots(experimental_drop, drop_data, user_inputs)
 
         loop = to_continue(delta[0] / drop_data.params, v, objective_function, steps_LMF, tolerances)
+    fitting_plots.flush()
     drop_data.fitted = True
+    drop_data.converged = steps_LMF <= tolerances.MAXIMUM_FITTING_STEPS
+    drop_data.objective_function = Sold / degrees_of_freedom
+
+# implements a trust region Levenberg--Marquardt algorithm (Nielsen damping update)
+# the damped normal equations are solved by Cholesky factorisation, a rejected
+# step restores the previous parameters and only increases the damping
+def fit_trust_region(experimental_drop, drop_data, user_inputs, tolerances):
+    fitting_plots = FittingPlots(user_inputs.plot_process)
+    degrees_of_freedom = len(experimental_drop.drop_data) - drop_data.parameter_dimensions + 1
+    steps_LMF = 0 # number of steps taken
+    intialise_print_output()
+    jacobian, residuals, arc_lengths = calculate_jacobian(experimental_drop, drop_data, tolerances)
+    drop_data.previous_params = drop_data.params # parameters of the stored residuals
+    drop_data.residuals = residuals
+    drop_data.arc_lengths = arc_lengths
+    A, v, S = normal_equations(jacobian, residuals)
+    mu = 0. # start with Gauss--Newton steps
+    nu = 2.
+    loop = True
+    while(loop):
+        scaling = np.diag(A).copy()
+        scaling[scaling == 0] = 1.
+        delta = solve_damped(A, mu * scaling, v)
+        predicted_reduction = dot(delta, mu * scaling * delta) - dot(delta, v[:, 0])
+        if convergence_in_reduction(predicted_reduction, S):
+            break
+        step = delta
+        if GEODESIC_ACCELERATION:
+            acceleration = geodesic_acceleration(experimental_drop, drop_data, tolerances, jacobian, residuals, delta, A, mu * scaling)
+            if 2 * np.linalg.norm(acceleration) <= GEODESIC_ALPHA * np.linalg.norm(delta):
+                step = delta + 0.5 * acceleration
+        params = drop_data.params
+        drop_data.params = params + step
+        jacobian_new, residuals_new, arc_lengths_new = calculate_jacobian(experimental_drop, drop_data, tolerances)
+        A_new, v_new, S_new = normal_equations(jacobian_new, residuals_new)
+        R = (S - S_new) / predicted_reduction
+        if (S_new < S) and (R > 0): # accept the step
+            jacobian, residuals, arc_lengths = jacobian_new, residuals_new, arc_lengths_new
+            A, v, S = A_new, v_new, S_new
+            mu = mu * max(1/3., 1 - (2 * R - 1)**3)
+            nu = 2.
+        else: # reject the step and shrink the trust region
+            drop_data.params = params
+            mu = max(mu * nu, TRUST_REGION_MU)
+            nu = 2 * nu
+        drop_data.previous_params = drop_data.params # parameters of the stored residuals
+        drop_data.residuals = residuals
+        drop_data.arc_lengths = arc_lengths
+        objective_function = S / degrees_of_freedom
+        steps_LMF += 1
+        print_current_parameters(steps_LMF, objective_function, drop_data.params)
+
+        fitting_plots.update_plots(experimental_drop, drop_data, user_inputs)
+
+        loop = to_continue(step / drop_data.params, v, objective_function, steps_LMF, tolerances)
+    fitting_plots.flush()
+    drop_data.fitted = True
+    drop_data.converged = steps_LMF <= tolerances.MAXIMUM_FITTING_STEPS
+    drop_data.objective_function = S / degrees_of_freedom
+
+# solves (A + diag(damping)) delta = -v by Cholesky factorisation
+# (pseudo-inverse if the matrix is singular, e.g. a parameter the data does not constrain)
+def solve_damped(A, damping, v):
+    matrix = A + np.diag(damping)
+    try:
+        return -scipy.linalg.cho_solve(scipy.linalg.cho_factor(matrix), v)[:, 0]
+    except np.linalg.LinAlgError:
+        return -dot(np.linalg.pinv(matrix), v)[:, 0]
+
+# second order correction to the step delta from the second directional
+# derivative of the residuals, estimated by finite differences along delta
+def geodesic_acceleration(experimental_drop, drop_data, tolerances, jacobian, residuals, delta, A, damping):
+    params = drop_data.params
+    drop_data.params = params + GEODESIC_STEP * delta
+    residuals_step = calculate_jacobian(experimental_drop, drop_data, tolerances)[1]
+    drop_data.params = params
+    second_derivative = 2 / GEODESIC_STEP * ((residuals_step - residuals) / GEODESIC_STEP - dot(jacobian, delta))
+    return solve_damped(A, damping, dot(jacobian.T, second_derivative).reshape(-1, 1))
 
 # ensure nu is between 2 and 10
 def bounded_2_to_10(nu):
@@ -81,6 +203,26 @@ def inverse_matrix(matrix):
 
 
 def calculate_A_v_S(experimental_drop, drop_data, tolerances):
+    if not BATCH_JACOBIAN:
+        return calculate_A_v_S_rowwise(experimental_drop, drop_data, tolerances)
+    jacobian, residual_vector, arc_lengths_vector = calculate_jacobian(experimental_drop, drop_data, tolerances)
+    drop_data.residuals = residual_vector
+    drop_data.arc_lengths = arc_lengths_vector
+    return normal_equations(jacobian, residual_vector)
+
+# the Jacobian, residuals and arc lengths of all data points at the current parameters
+# (the trust region method always uses this, whatever BATCH_JACOBIAN)
+def calculate_jacobian(experimental_drop, drop_data, tolerances):
+    return batch_jacobian(experimental_drop.drop_data, drop_data, tolerances)
+
+def normal_equations(jacobian, residual_vector):
+    A = dot(jacobian.T, jacobian)
+    v = dot(jacobian.T, residual_vector).reshape(-1, 1)
+    S = dot(residual_vector, residual_vector)
+    return [A, v, S]
+
+# builds A and v one data point at a time using rowJacobian
+def calculate_A_v_S_rowwise(experimental_drop, drop_data, tolerances):
     lenpoints = len(experimental_drop.drop_data)
     m_parameters = len(drop_data.params)
     A = np.empty((m_parameters, m_parameters))
@@ -142,6 +284,14 @@ def convergence_in_objective(objective_function, tolerances):
     else:
         return False
 
+# test if the step would reduce the objective function by less than its numerical noise
+def convergence_in_reduction(predicted_reduction, S):
+    if predicted_reduction < REDUCTION_TOL * S:
+        print("Convergence in objective reduction")
+        return True
+    else:
+        return False
+
 # test maximum steps
 def maximum_steps_exceeded(steps_LMF, tolerances):
     if steps_LMF > tolerances.MAXIMUM_FITTING_STEPS:
@@ -2,7 +2,8 @@
 # coding=utf-8
 
 from de_YoungLaplace import dataderiv
-from scipy.integrate import odeint
+from de_YoungLaplace import solve_from_apex
+from de_YoungLaplace import DATA_COMPONENTS
 
 import numpy as np
 
@@ -54,10 +55,8 @@ def fitted_vol_area(fitted_drop_data):
     # s_needle = fitted_drop_data.max_s
     s_needle = max(abs(fitted_drop_data.arc_lengths))
     s_data_points = np.linspace(0, s_needle, fitted_drop_data.s_points + 1)
-    # EPS = .000001 # need to use Bessel function Taylor expansion below
     # bond_number = fitted_drop_data.bond()
     a_radius_px = fitted_drop_data.previous_params[2]
     bond_number = fitted_drop_data.previous_params[3]
-    x_vec_initial = [.000001, 0., 0., 0., 0.]
-    vol_sur = odeint(dataderiv, x_vec_initial, s_data_points, args=(bond_number,))[-1,-2:]
+    vol_sur = solve_from_apex(dataderiv, s_data_points, bond_number, DATA_COMPONENTS)[-1,-2:]
     return (vol_sur * [a_radius_px**3, a_radius_px**2])
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+#coding=utf-8
+from __future__ import print_function
+import threading
+import Queue
+import atexit
+import cv2
+import numpy as np
+
+# saved images are written by background threads so encoding never delays the capture
+ARCHIVE_THREADS = 2
+ARCHIVE_QUEUE_SIZE = 16 # frames waiting to be written, capture waits beyond this rather than lose frames
+ARCHIVE_FORMAT = "png" # "png", or "npy" for raw arrays (fastest, no encoding)
+PNG_COMPRESSION = None # None for OpenCV's fast default, else 0 (no compression) to 9 (smallest files)
+
+class ImageArchiver(object):
+    def __init__(self, n_threads=ARCHIVE_THREADS, queue_size=ARCHIVE_QUEUE_SIZE,
+                 archive_format=ARCHIVE_FORMAT, png_compression=PNG_COMPRESSION):
+        self.queue = Queue.Queue(queue_size)
+        self.archive_format = archive_format
+        self.png_compression = png_compression
+        self.queued = 0
+        self.written = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self.write_loop) for i in range(n_threads)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+        atexit.register(self.close) # queued frames are written before the program exits
+
+    # queues image to be saved as filename (its extension is replaced for npy)
+    def save(self, filename, image):
+        if self.archive_format == "npy":
+            filename = filename.rsplit('.', 1)[0] + ".npy"
+        self.queue.put((filename, image))
+        self.queued += 1
+
+    def write_loop(self):
+        while True:
+            filename, image = self.queue.get()
+            try:
+                if filename is None:
+                    return
+                if self.archive_format == "npy":
+                    np.save(filename, image)
+                    written = True
+                else:
+                    written = cv2.imwrite(filename, image, self.png_parameters())
+                with self.lock:
+                    if written:
+                        self.written += 1
+                    else:
+                        self.failed += 1
+                if not written:
+                    print("WARNING: could not save " + filename)
+            except (IOError, OSError) as error:
+                with self.lock:
+                    self.failed += 1
+                print("WARNING: could not save %s (%s)" % (filename, error))
+            finally:
+                self.queue.task_done()
+
+    def png_parameters(self):
+        if self.png_compression is None:
+            return []
+        return [cv2.IMWRITE_PNG_COMPRESSION, self.png_compression]
+
+    # waits until every queued frame is written
+    def flush(self):
+        self.queue.join()
+
+    def close(self):
+        if self.threads:
+            self.flush()
+            for thread in self.threads:
+                self.queue.put((None, None))
+            for thread in self.threads:
+                thread.join()
+            self.threads = []
+            print("Images saved: %d queued, %d written, %d failed" % (self.queued, self.written, self.failed))
@@ -3,14 +3,77 @@
 import math
 import sys
 
+import numpy as np
+
+ARCLENGTH_MARGIN = 1.2 # safety factor applied to the estimated arc length of the drop
+MAX_S_CARRY_RATIO = 1.5 # previous max_s is kept while it is at most this factor too large
+CHORD_TO_ARC = math.pi / (2 * math.sqrt(2)) # arc to chord length ratio of a quarter circle
+CONTOUR_CHANGE_TOL = 0.05 # relative change in drop height or width that forces reinitialisation
+WARM_START_OBJECTIVE_TOL = 1. # mean squared residual (pixels^2) above which a fit is not reused
+
 
 def initialise_parameters(experimental_drop, drop_data):
     omega_rotation = 0.0 # initial rotation angle (should revisit this)
     [x_apex, y_apex, radius_apex] = fit_circle(experimental_drop.drop_data)
     bond_number = calculate_Bond_number(experimental_drop.drop_data, x_apex, y_apex, radius_apex)
     drop_data.params = [x_apex, y_apex, radius_apex, bond_number, omega_rotation]
-    # maybe calculate_max_s() to determine initial max_s - although current version can handle max_s being too small
-    drop_data.max_s = 4.0
+    set_max_s(experimental_drop, drop_data, x_apex, y_apex, radius_apex)
+    drop_data.contour_extent = contour_extent(experimental_drop.drop_data)
+    drop_data.previous_extent = drop_data.contour_extent
+    drop_data.arc_length_cache = None # closest points are searched from scratch
+
+# seeds the fit with the previous frame's parameters, moved with the apex, and
+# integration domain, falling back to initialise_parameters on the first frame,
+# after a failed fit, or when the drop has changed shape too much since the frame
+# that was initialised
+def warm_start_parameters(experimental_drop, drop_data):
+    extent = contour_extent(experimental_drop.drop_data)
+    if (drop_data.contour_extent is None) or (not fit_reusable(drop_data)) or contour_changed(extent, drop_data.contour_extent):
+        initialise_parameters(experimental_drop, drop_data)
+        return
+    x_shift = extent[0] - drop_data.previous_extent[0]
+    y_shift = extent[1] - drop_data.previous_extent[1]
+    x_apex, y_apex, radius_apex, bond_number, omega_rotation = drop_data.params
+    drop_data.params = [x_apex + x_shift, y_apex + y_shift, radius_apex, bond_number, omega_rotation]
+    set_max_s(experimental_drop, drop_data, x_apex + x_shift, y_apex + y_shift, radius_apex)
+    drop_data.previous_extent = extent
+
+# tests if the last fit converged to finite parameters that fit the contour
+def fit_reusable(drop_data):
+    if not drop_data.converged:
+        return False
+    if not np.isfinite(drop_data.params).all():
+        return False
+    return drop_data.objective_function <= WARM_START_OBJECTIVE_TOL
+
+# centre line x, apex height, height and width of the drop contour
+def contour_extent(xypoints):
+    x_min = xypoints[:, 0].min()
+    x_max = xypoints[:, 0].max()
+    return [0.5 * (x_min + x_max), xypoints[0, 1], xypoints[-1, 1] - xypoints[0, 1], x_max - x_min]
+
+# tests if the drop height or width has changed by more than CONTOUR_CHANGE_TOL
+def contour_changed(extent, previous_extent):
+    height_change = abs(extent[2] - previous_extent[2]) / float(previous_extent[2])
+    width_change = abs(extent[3] - previous_extent[3]) / float(previous_extent[3])
+    return max(height_change, width_change) > CONTOUR_CHANGE_TOL
+
+def set_max_s(experimental_drop, drop_data, x_apex, y_apex, radius_apex):
+    max_s = estimate_max_s(experimental_drop.drop_data, x_apex, y_apex, radius_apex)
+    if (drop_data.max_s is not None) and (max_s <= drop_data.max_s <= MAX_S_CARRY_RATIO * max_s):
+        max_s = drop_data.max_s # carry over the integration domain from the previous frame
+    drop_data.max_s = max_s
+
+# estimates the dimensionless arc length from the apex to the top of the contour
+# the profile is approximated by the chords apex -> widest point -> highest point
+def estimate_max_s(xypoints, x_apex, y_apex, radius_apex):
+    r_scaled = np.abs(xypoints[:, 0] - x_apex) / radius_apex
+    z_scaled = (xypoints[:, 1] - y_apex) / radius_apex
+    widest = r_scaled.argmax()
+    highest = z_scaled.argmax()
+    chord_lengths = (math.hypot(r_scaled[widest], z_scaled[widest])
+                     + math.hypot(r_scaled[widest] - r_scaled[highest], z_scaled[highest] - z_scaled[widest]))
+    return ARCLENGTH_MARGIN * CHORD_TO_ARC * chord_lengths
 
 
 # fits a circle to the drop apex to calculate the (x, y) coordinate and apex radius R_0
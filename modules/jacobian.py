@@ -3,6 +3,7 @@
 # from scipy.integrate import odeint
 import numpy as np
 import math
+from scipy.spatial import cKDTree
 # import sys
 # from classes import ExperimentalDrop, DropData, Tolerances
 
@@ -81,6 +82,96 @@ def minimum_arclength(x, y, s_i, drop_data, tolerances):
     drop_data.s_previous = s_i
     return [xs, ys, dx_dBs, dy_dBs, e_r, e_z, s_i]
 
+# calculates the Jacobian matrix and residual vector for all data points at once
+# returns J (N x 5), the residuals (N) and the arc lengths at the closest points (N)
+def batch_jacobian(xy_data, drop_data, tolerances):
+    [xP, yP, RP, BP, wP] = drop_data.params
+    n_points = len(xy_data)
+    x = xy_data[:, 0]
+    y = xy_data[:, 1]
+    x_rotated = (x - xP) * cos(wP) - (y - yP) * sin(wP)
+    y_rotated = (x - xP) * sin(wP) + (y - yP) * cos(wP)
+    s_0 = cached_arclengths(xy_data, x_rotated, y_rotated, drop_data)
+    xs, ys, dx_dBs, dy_dBs, e_r, e_z, s_i = batch_minimum_arclength(x_rotated, y_rotated, s_0, drop_data, tolerances)
+    drop_data.arc_length_cache = s_i
+    drop_data.arc_length_cache_points = xy_data
+    drop_data.arc_length_cache_params = np.array(drop_data.params)
+    drop_data.arc_length_cache_scaled = np.column_stack((np.abs(x_rotated), y_rotated)) / RP
+    e_i = np.copysign(np.sqrt(e_r**2 + e_z**2), e_r)                      # actual residuals
+    sgnx = np.copysign(1, x_rotated)                                       # signs for ddi_dX0
+    jacobian = np.empty((n_points, 5))
+    jacobian[:, 0] = -( e_r * sgnx * cos(wP) + e_z * sin(wP)) / e_i        # derivative w.r.t. X_0 (x at apex)
+    jacobian[:, 1] = -(-e_r * sgnx * sin(wP) + e_z * cos(wP)) / e_i        # derivative w.r.t. Y_0 (y at apex)
+    jacobian[:, 2] = -( e_r * xs + e_z * ys) / e_i                         # derivative w.r.t. RP (apex radius)
+    jacobian[:, 3] = - RP * (e_r * dx_dBs + e_z * dy_dBs) / e_i            # derivative w.r.t. Bo  (Bond number)
+    jacobian[:, 4] = (- e_r * sgnx * y_rotated + e_z * x_rotated) / e_i    # derivative w.r.t. omega (rotation)
+    return [jacobian, e_i, s_i]
+
+# starting arc lengths for the Newton iterations: each point's previous solution while the
+# profile has moved less than the table spacing since, otherwise the closest tabulated point
+# points of a new contour take the solution of the nearest point of the previous contour
+def cached_arclengths(xy_data, x_rotated, y_rotated, drop_data):
+    s_cached = drop_data.arc_length_cache
+    if (s_cached is None) or (profile_shift(drop_data) > drop_data.max_s / drop_data.s_points):
+        return initial_arclengths(x_rotated, y_rotated, drop_data)
+    if (len(drop_data.arc_length_cache_points) != len(xy_data)) or not np.array_equal(drop_data.arc_length_cache_points, xy_data):
+        # the closest point only depends on the position relative to the apex, scaled by the apex radius
+        RP = drop_data.params[2]
+        scaled_points = np.column_stack((np.abs(x_rotated), y_rotated)) / RP
+        s_cached = s_cached[cKDTree(drop_data.arc_length_cache_scaled).query(scaled_points)[1]]
+    return np.clip(s_cached, 0, drop_data.max_s)
+
+# bound on how far (in units of the apex radius) the profile has moved since the arc length cache
+def profile_shift(drop_data):
+    [xP, yP, RP, BP, wP] = drop_data.params
+    [xC, yC, RC, BC, wC] = drop_data.arc_length_cache_params
+    max_s = drop_data.max_s
+    return (math.hypot(xP - xC, yP - yC) + abs(RP - RC) * max_s) / RP + (abs(wP - wC) + abs(BP - BC)) * max_s
+
+# starting arc lengths for the Newton iterations: the closest tabulated profile point
+# x_rotated, y_rotated are the data points in the frame of the drop apex
+def initial_arclengths(x_rotated, y_rotated, drop_data):
+    RP = drop_data.params[2]
+    table = drop_data.theoretical_data
+    r_scaled = np.abs(x_rotated) / RP
+    z_scaled = y_rotated / RP
+    distances = (r_scaled[:, np.newaxis] - table[:, 0])**2 + (z_scaled[:, np.newaxis] - table[:, 1])**2
+    Delta_s = drop_data.max_s / drop_data.s_points
+    return Delta_s * distances.argmin(axis=1)
+
+# calculates the minimum theoretical points to all points (x_rotated, y_rotated) at once
+# Newton iterations are only applied to the points that have not yet converged
+def batch_minimum_arclength(x_rotated, y_rotated, s_0, drop_data, tolerances):
+    [xP, yP, RP, BP, wP] = drop_data.params # unpack parameters
+    n_points = len(s_0)
+    s_i = np.array(s_0, dtype=float)
+    closest = np.zeros((n_points, 6)) # xs, ys, dx_dBs, dy_dBs, e_r, e_z
+    flag_bump = np.zeros(n_points, dtype=int)
+    active = np.arange(n_points)
+    s_step = 0
+    while (len(active) > 0) and (s_step < tolerances.MAXIMUM_ARCLENGTH_STEPS):
+        s_active = s_i[active]
+        xs, ys, phis, dx_dBs, dy_dBs, dphi_dBs = drop_data.profile(s_active).T
+        e_r = np.abs(x_rotated[active]) - RP * xs
+        e_z = y_rotated[active] - RP * ys
+        dphi_ds = 2 - BP * ys - sin(phis) / xs
+        s_iplus1 = s_active - f_Newton(e_r, e_z, phis, dphi_ds, RP)
+        outside = s_iplus1 < 0 # arc length outside integrated region
+        s_iplus1[outside] = 0
+        flag_bump[active[outside]] += 1
+        closest[active] = np.column_stack((xs, ys, dx_dBs, dy_dBs, e_r, e_z))
+        s_i[active] = s_iplus1
+        # points that have already been pushed back twice are aborted, the others take at least one
+        # Newton step so that the residuals are never evaluated at an unimproved (e.g. cached) arc length
+        finished = ((np.abs(s_iplus1 - s_active) < tolerances.ARCLENGTH_TOL) & (s_step > 0)) | (flag_bump[active] >= 2)
+        active = active[~finished]
+        s_step += 1
+    drop_data.unconverged_points = active
+    if len(active) > 0:
+        print("s failed to converge in %d steps for %d of %d points..." % (s_step, len(active), n_points))
+    xs, ys, dx_dBs, dy_dBs, e_r, e_z = closest.T
+    return [xs, ys, dx_dBs, dy_dBs, e_r, e_z, s_i]
+
 # the function g(s) used in finding the arc length for the minimal distance
 def f_Newton(e_r, e_z, phi, dphids, RP):
     f = - (e_r * cos(phi) + e_z * sin(phi)) / (RP + dphids * (e_r * sin(phi) - e_z * cos(phi)))
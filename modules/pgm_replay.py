@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+#coding=utf-8
+# stand-in for the Flea3 capture helper (see read_image.Flea3Stream): for each line read
+# from stdin, writes the next of the given images to stdout as a binary PGM frame,
+# cycling through them, until stdin is closed
+#     python pgm_replay.py frames/*.pgm
+# images that are not PGM files (and directories of images) are converted to gray first
+from __future__ import print_function
+import os
+import sys
+import cv2
+
+def load_frames(paths):
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames += sorted(os.path.join(path, name) for name in os.listdir(path))
+        else:
+            filenames.append(path)
+    frames = []
+    for filename in filenames:
+        if filename.lower().endswith('.pgm'):
+            with open(filename, 'rb') as f:
+                frames.append(f.read())
+        else:
+            image = cv2.imread(filename, 0)
+            if image is not None:
+                frames.append(cv2.imencode('.pgm', image)[1].tostring())
+    return frames
+
+def main(paths):
+    frames = load_frames(paths)
+    if not frames:
+        print("No frames to replay", file=sys.stderr)
+        sys.exit(1)
+    stdout = os.fdopen(sys.stdout.fileno(), 'wb', 0)
+    n = 0
+    for line in iter(sys.stdin.readline, ''):
+        stdout.write(frames[n % len(frames)])
+        n += 1
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
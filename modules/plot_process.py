@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+#coding=utf-8
+from __future__ import print_function
+from FittingPlots import FittingPlots
+from PlotManager import PlotManager
+
+import multiprocessing
+import Queue
+import timeit
+
+# the fitting and time-series plots are drawn by a separate process fed with snapshots
+# of the plot data, so drawing never holds up the fit
+PLOT_RATE = 5. # maximum number of fitting plot updates sent per second
+PLOT_QUEUE_SIZE = 8 # snapshots waiting to be drawn, newer snapshots are dropped beyond this
+PLOT_PAUSE = 0.05 # time the plot process spends handling window events while idle
+PLOT_PUT_TIMEOUT = 1. # longest wait to queue a snapshot that must be drawn
+PLOT_CLOSE_TIMEOUT = 30. # longest wait for the plot process to take the end of the snapshots
+
+class PlotProcess(object):
+    def __init__(self, rate=PLOT_RATE, queue_size=PLOT_QUEUE_SIZE):
+        self.queue = multiprocessing.Queue(queue_size)
+        self.process = multiprocessing.Process(target=plot_loop, args=(self.queue,))
+        self.process.daemon = True # closes the plot windows when the program quits
+        self.process.start()
+        self.interval = 1. / rate
+        self.last_sent = {}
+        self.sent = 0
+        self.dropped = 0
+
+    # tests if a snapshot of kind is allowed by the rate limit
+    def due(self, kind):
+        return timeit.default_timer() - self.last_sent.get(kind, -self.interval) >= self.interval
+
+    # queues a snapshot without waiting, if the queue is full the snapshot is dropped,
+    # unless force is set in which case it waits (up to PLOT_PUT_TIMEOUT) for the plot process
+    def send(self, kind, snapshot, force=False):
+        try:
+            if force:
+                self.queue.put((kind, snapshot), timeout=PLOT_PUT_TIMEOUT)
+            else:
+                self.queue.put_nowait((kind, snapshot))
+        except Queue.Full:
+            self.dropped += 1
+            return
+        self.last_sent[kind] = timeit.default_timer()
+        self.sent += 1
+
+    # waits for the queued snapshots to be drawn and for the plot windows to be closed,
+    # which ends the plot process
+    def close(self):
+        self.print_summary()
+        try:
+            self.queue.put((None, None), timeout=PLOT_CLOSE_TIMEOUT)
+        except Queue.Full: # the plot process has stopped taking snapshots
+            self.process.terminate()
+            self.queue.cancel_join_thread()
+        if self.sent > 0:
+            print("Close the plot windows to finish")
+        self.process.join()
+        self.queue.close()
+        self.queue.join_thread() # returns once the plot process has read everything sent
+
+    def print_summary(self):
+        print("Plot snapshots: %d sent, %d dropped" % (self.sent, self.dropped))
+
+
+# runs in the plot process: draws the latest snapshot of each kind until sent None,
+# then keeps the plot windows open until they are closed
+def plot_loop(queue):
+    import matplotlib.pyplot as plt
+    fitting_plots = None
+    time_plots = None
+    while True:
+        try:
+            snapshots = [queue.get(timeout=PLOT_PAUSE)]
+        except Queue.Empty:
+            plt.pause(PLOT_PAUSE)
+            continue
+        while True: # drain the queue, only the latest snapshot of each kind is drawn
+            try:
+                snapshots.append(queue.get_nowait())
+            except Queue.Empty:
+                break
+        latest = {}
+        for kind, snapshot in snapshots:
+            if kind == 'fitting' and ('image' in latest.get(kind, {})) and ('image' not in snapshot):
+                snapshot = dict(snapshot, image=latest[kind]['image']) # a new fit starts from its image
+            latest[kind] = snapshot
+        if ('fitting' in latest) and ((fitting_plots is None) or ('image' in latest['fitting'])):
+            fitting_plots = FittingPlots()
+        if ('time_series' in latest) and (time_plots is None):
+            time_plots = PlotManager(*latest['time_series']['frames'])
+            time_plots.initialise_plot()
+            time_plots.plots_initialised = True
+        plt.ioff() # redraw once per snapshot, not on every change of a line
+        if 'fitting' in latest:
+            fitting_plots.draw_snapshot(latest['fitting'])
+        if 'time_series' in latest:
+            time_plots.draw_snapshot(latest['time_series'])
+        if None in latest:
+            break
+        plt.pause(0.001)
+    if plt.get_fignums():
+        plt.show()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+#coding=utf-8
+from __future__ import print_function
+# fitting of single frames and of series of frames, shared by the user interface
+# (opendrop.py) and the headless batch mode (opendrop_batch.py), so it must not need Tk
+from classes import ExperimentalDrop, DropData, Tolerances
+from ExtractData import ExtractedData
+from read_image import import_from_source
+from read_image import save_image
+from read_image import release_sources
+from extract_profile import extract_drop_profile
+from initialise_parameters import initialise_parameters
+from initialise_parameters import warm_start_parameters
+from analyse_needle import calculate_needle_diameter
+from fit_data import fit_experimental_drop
+from generate_data import generate_full_data
+from profile_library import load_profile_library
+
+import os
+import sys
+import copy
+import multiprocessing
+import StringIO
+
+DELTA_TOL = 1.e-6
+GRADIENT_TOL = 1.e-6
+MAXIMUM_FITTING_STEPS = 10
+OBJECTIVE_TOL = 1.e-4
+ARCLENGTH_TOL = 1.e-6
+MAXIMUM_ARCLENGTH_STEPS = 10
+NEEDLE_TOL = 1.e-4
+NEEDLE_STEPS = 20
+DECIMATION_POINTS = [300] # contour points used by the coarse fitting stages, [] fits all points throughout
+DECIMATION_DELTA_TOL = 1.e-4
+USE_PROFILE_LIBRARY = True # interpolate profiles from a precomputed Bond number library
+WARM_START = True # start each frame from the previous frame's fit unless the drop has changed too much
+PARALLEL_CHUNKS_PER_WORKER = 2 # frames are split in contiguous chunks, each a warm start chain
+IMAGE_EXTENSION = '.png' # the output filename is the given name with this extension replaced
+
+def initialise_drop_data():
+    fitted_drop_data = DropData()
+    if USE_PROFILE_LIBRARY:
+        fitted_drop_data.profile_library = load_profile_library()
+    return fitted_drop_data
+
+def initialise_tolerances():
+    return Tolerances(
+        DELTA_TOL,
+        GRADIENT_TOL,
+        MAXIMUM_FITTING_STEPS,
+        OBJECTIVE_TOL,
+        ARCLENGTH_TOL,
+        MAXIMUM_ARCLENGTH_STEPS,
+        NEEDLE_TOL,
+        NEEDLE_STEPS,
+        DECIMATION_POINTS,
+        DECIMATION_DELTA_TOL)
+
+# the time stamp is set when the first frame is read
+def get_export_filename(user_inputs):
+    filename = user_inputs.filename[:-4] + '_' + user_inputs.time_string + ".csv"
+    return os.path.join(user_inputs.directory_string, filename)
+
+# extracts the profile from the image in raw_experiment, fits it and stores the results
+# for frame i in extracted_data, returning the time-IFT-volume-area vector
+def process_frame(raw_experiment, fitted_drop_data, user_inputs, tolerances, extracted_data, i):
+    fitted_drop_data.reset_profile_counters()
+    extract_drop_profile(raw_experiment, user_inputs, fitted_drop_data)
+    if i == 0:
+        extracted_data.initial_image_time = raw_experiment.time
+    if WARM_START:
+        warm_start_parameters(raw_experiment, fitted_drop_data)
+    else:
+        initialise_parameters(raw_experiment, fitted_drop_data)
+    calculate_needle_diameter(raw_experiment, fitted_drop_data, tolerances)
+    # fit_experimental_drop(raw_experiment, fitted_drop_data, tolerances)
+    fit_experimental_drop(raw_experiment, fitted_drop_data, user_inputs, tolerances)
+    print("Profiles generated: %d integrated, %d from library, %d max_s expansions" % (fitted_drop_data.profile_integrations,
+          fitted_drop_data.profile_library_lookups, fitted_drop_data.max_s_expansions))
+    generate_full_data(extracted_data, raw_experiment, fitted_drop_data, user_inputs, i)
+    return extracted_data.time_IFT_vol_area(i)
+
+# state of a worker process of process_frames_parallel, set up once by initialise_worker
+worker_state = {}
+
+# fits the frames of user_inputs on n_workers processes, merging the results into
+# extracted_data and yielding each frame number in order once its results are in
+# (with the console output of its fit), the images must not depend on when they are read
+# the workers share the profile library of fitted_drop_data
+def process_frames_parallel(user_inputs, fitted_drop_data, extracted_data, n_workers):
+    n_frames = user_inputs.number_of_frames
+    n_chunks = min(n_frames, n_workers * PARALLEL_CHUNKS_PER_WORKER)
+    chunks = [range(n_frames)[(k * n_frames) // n_chunks:((k + 1) * n_frames) // n_chunks] for k in range(n_chunks)]
+    release_sources(user_inputs) # no decoding threads are left running when the workers start
+    pool = multiprocessing.Pool(n_workers, initialise_worker, (worker_settings(user_inputs), fitted_drop_data.profile_library))
+    try:
+        for results in pool.imap(process_chunk, chunks):
+            for i, values, output in results:
+                sys.stdout.write(output)
+                extracted_data.set_frame_values(i, values)
+                yield i
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+# a copy of user_inputs without the plot process and image sources, which cannot be
+# pickled for the workers (each worker opens its own sources and saves its own images)
+def worker_settings(user_inputs):
+    user_inputs = copy.copy(user_inputs)
+    user_inputs.residuals_boole = False # fitting plots only make sense for frames in order
+    user_inputs.profiles_boole = False
+    user_inputs.plot_process = None
+    user_inputs.video_capture = None
+    user_inputs.file_source = None
+    user_inputs.camera_source = None
+    user_inputs.image_archiver = None
+    return user_inputs
+
+def initialise_worker(user_inputs, profile_library):
+    worker_state['user_inputs'] = user_inputs
+    worker_state['tolerances'] = initialise_tolerances()
+    worker_state['profile_library'] = profile_library
+
+# fits the contiguous frames frame_numbers, each starting from the previous one's fit
+# the console output of each frame is returned with its results, so the parent can
+# print it in frame order
+def process_chunk(frame_numbers):
+    user_inputs = worker_state['user_inputs']
+    fitted_drop_data = DropData()
+    fitted_drop_data.profile_library = worker_state['profile_library']
+    extracted_data = ExtractedData(user_inputs.number_of_frames, fitted_drop_data.parameter_dimensions)
+    extracted_data.initial_image_time = 0 # the time of frame 0, see read_image.import_from_source
+    results = []
+    stdout = sys.stdout
+    try:
+        for i in frame_numbers:
+            sys.stdout = StringIO.StringIO()
+            print("\nProcessing frame %d of %d..." % (i+1, user_inputs.number_of_frames))
+            raw_experiment = ExperimentalDrop()
+            import_from_source(raw_experiment, user_inputs, i)
+            if user_inputs.save_images_boole:
+                save_image(raw_experiment, user_inputs, i)
+            process_frame(raw_experiment, fitted_drop_data, user_inputs, worker_state['tolerances'], extracted_data, i)
+            results.append((i, extracted_data.frame_values(i), sys.stdout.getvalue()))
+    finally:
+        sys.stdout = stdout
+        release_sources(user_inputs) # waits for the images of the chunk to be saved
+    return results
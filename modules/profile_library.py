@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+#coding=utf-8
+from __future__ import print_function
+from de_YoungLaplace import ylderiv
+from de_YoungLaplace import apex_series
+from de_YoungLaplace import apex_series_derivative
+from de_YoungLaplace import APEX_SERIES_S
+from de_YoungLaplace import APEX_X
+from interpolation_function import cubic_interpolation_function
+from batch_integrator import integrate_profiles
+
+import numpy as np
+import os
+import sys
+import glob
+
+# dimensionless profile grid: Bond number x arc length x (x, z, phi, dx/dBo, dz/dBo, dphi/dBo)
+BOND_MIN = 0.0
+BOND_MAX = 0.75
+BOND_POINTS = 301
+S_MAX = 8.0
+S_POINTS = 2000
+X_CLOSURE = 0.02 # profiles are only served up to where x drops below this value
+LIBRARY_TOL = 1.e-10 # integration tolerance used when generating the library
+LIBRARY_VERSION = 3 # increase whenever generate_profile_library changes, so older library files are not reused
+
+LIBRARY_PREFIX = "profile_library_"
+LIBRARY_FILENAME = LIBRARY_PREFIX + "v%d_Bo%g-%g_%d_s%g_%d.npy" % (LIBRARY_VERSION, BOND_MIN, BOND_MAX, BOND_POINTS, S_MAX, S_POINTS)
+
+# the library is cached per user, as the program directory may be read-only (e.g. an app bundle)
+def library_directory():
+    if os.name == 'nt':
+        cache_directory = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+    elif sys.platform == 'darwin':
+        cache_directory = os.path.join(os.path.expanduser('~'), 'Library', 'Caches')
+    else:
+        cache_directory = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cache_directory, 'opendrop')
+
+PATH_TO_LIBRARY = os.path.join(library_directory(), LIBRARY_FILENAME)
+
+# returns the profile library, generating and saving it to disk on first use
+def load_profile_library(filename=PATH_TO_LIBRARY):
+    if os.path.exists(filename):
+        return ProfileLibrary(np.load(filename, mmap_mode='r'), filename) # memory-mapped, so later runs start warm
+    print("Generating profile library...")
+    data = generate_profile_library()
+    if save_profile_library(data, filename):
+        remove_old_libraries(filename)
+        return ProfileLibrary(data, filename)
+    return ProfileLibrary(data)
+
+# integrates the Young--Laplace equation for all Bond numbers of the grid at once
+# starting from the apex series at APEX_SERIES_S
+def generate_profile_library():
+    bond_numbers = np.linspace(BOND_MIN, BOND_MAX, BOND_POINTS)
+    s_data_points = np.linspace(0, S_MAX, S_POINTS + 1)
+    series_points = s_data_points <= APEX_SERIES_S
+    s_integrate = np.concatenate(([APEX_SERIES_S], s_data_points[~series_points]))
+    data = np.empty((BOND_POINTS, S_POINTS + 1, 6))
+    x_vec_initial = np.empty((BOND_POINTS, 6))
+    for k in range(BOND_POINTS):
+        data[k, series_points] = apex_series(s_data_points[series_points], bond_numbers[k])
+        x_vec_initial[k] = apex_series(APEX_SERIES_S, bond_numbers[k])
+    data[:, ~series_points] = integrate_profiles(ylderiv, x_vec_initial, s_integrate, bond_numbers,
+                                                 rtol=LIBRARY_TOL, atol=LIBRARY_TOL, closure_x=X_CLOSURE)[:, 1:]
+    data[:, 0, 0] = APEX_X
+    return data
+
+# write to a temporary file first so a partially written library is never loaded,
+# returns whether the library was saved
+def save_profile_library(data, filename):
+    temp_filename = filename + ".tmp"
+    try:
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(temp_filename, 'wb') as f:
+            np.save(f, data)
+        os.rename(temp_filename, filename)
+    except (IOError, OSError):
+        print("WARNING: could not save the profile library to " + filename)
+        return False
+    return True
+
+# deletes the libraries of other versions or grids, next to filename and in the
+# program directory where they used to be saved
+def remove_old_libraries(filename):
+    for directory in set([os.path.dirname(filename), os.path.dirname(os.path.realpath(__file__))]):
+        for old_filename in glob.glob(os.path.join(directory, LIBRARY_PREFIX + "*.npy")):
+            if os.path.realpath(old_filename) != os.path.realpath(filename):
+                try:
+                    os.remove(old_filename)
+                except OSError:
+                    pass
+
+
+# a saved library is pickled as its filename, so worker processes map the same file
+# instead of receiving (or generating) their own copy
+class ProfileLibrary(object):
+    def __init__(self, data, filename=None):
+        self.data = data
+        self.filename = filename # None if the library is only held in memory
+        self.bond_numbers = np.linspace(BOND_MIN, BOND_MAX, BOND_POINTS)
+        self.Delta_bond = self.bond_numbers[1] - self.bond_numbers[0]
+        self.Delta_s = S_MAX / S_POINTS
+        self.valid_s = self.valid_arc_lengths()
+
+    # the arc length up to which each tabulated profile is physical
+    # (finite, and away from the apex the profile has not closed back onto the axis)
+    def valid_arc_lengths(self):
+        x_values = np.asarray(self.data[:, :, 0])
+        s_values = self.Delta_s * np.arange(S_POINTS + 1)
+        closed = (x_values < X_CLOSURE) & (s_values > 1.0)
+        invalid = ~np.isfinite(np.asarray(self.data)).all(axis=2) | closed
+        first_invalid = np.where(invalid.any(axis=1), invalid.argmax(axis=1), S_POINTS + 1)
+        return self.Delta_s * (first_invalid - 1)
+
+    def __getstate__(self):
+        if self.filename is not None:
+            return {'filename': self.filename}
+        return {'data': np.asarray(self.data)}
+
+    def __setstate__(self, state):
+        if 'filename' in state:
+            self.__init__(np.load(state['filename'], mmap_mode='r'), state['filename'])
+        else:
+            self.__init__(state['data'])
+
+    # tests if the profile with bond_number up to max_s can be served by interpolation
+    def covers(self, bond_number, max_s):
+        if (bond_number < BOND_MIN) or (bond_number >= BOND_MAX):
+            return False
+        k = int((bond_number - BOND_MIN) / self.Delta_bond)
+        return max_s <= min(self.valid_s[k], self.valid_s[k + 1])
+
+    # returns the profile at the arc lengths s_data_points, or None outside the grid
+    def profile_data(self, bond_number, s_data_points):
+        if not self.covers(bond_number, s_data_points[-1]):
+            return None
+        k = int((bond_number - BOND_MIN) / self.Delta_bond)
+        t_bond = (bond_number - self.bond_numbers[k]) / self.Delta_bond
+        n1 = np.minimum((s_data_points / self.Delta_s).astype(int), S_POINTS - 1)
+        t = (s_data_points / self.Delta_s - n1)[:, np.newaxis]
+        vec1 = self.bond_interpolation(k, n1, t_bond)
+        vec2 = self.bond_interpolation(k, n1 + 1, t_bond)
+        Dvec1 = self.arc_length_derivative(vec1, self.Delta_s * n1, bond_number)
+        Dvec2 = self.arc_length_derivative(vec2, self.Delta_s * (n1 + 1), bond_number)
+        return cubic_interpolation_function(vec1, vec2, Dvec1, Dvec2, self.Delta_s, t)
+
+    # slopes for the arc length interpolation, from the apex series near the apex
+    def arc_length_derivative(self, vec, s_values, bond_number):
+        Dvec = np.array(ylderiv(vec.T, 0, bond_number)).T
+        series_points = s_values <= APEX_SERIES_S
+        Dvec[series_points] = apex_series_derivative(s_values[series_points], bond_number)
+        return Dvec
+
+    # interpolates rows n of the library in Bond number
+    # (x, z, phi) are cubic using the tabulated Bond derivatives, the derivatives
+    # themselves are cubic using finite difference slopes (Catmull--Rom)
+    def bond_interpolation(self, k, n, t_bond):
+        k_below = max(k - 1, 0)
+        k_above = min(k + 2, BOND_POINTS - 1)
+        rows0 = np.asarray(self.data[k_below, n, 3:])
+        rows1 = np.asarray(self.data[k, n])
+        rows2 = np.asarray(self.data[k + 1, n])
+        rows3 = np.asarray(self.data[k_above, n, 3:])
+        slopes1 = (rows2[:, 3:] - rows0) / (k + 1 - k_below)
+        slopes2 = (rows3 - rows1[:, 3:]) / (k_above - k)
+        values = np.empty(rows1.shape)
+        values[:, :3] = cubic_interpolation_function(rows1[:, :3], rows2[:, :3], rows1[:, 3:], rows2[:, 3:], self.Delta_bond, t_bond)
+        values[:, 3:] = cubic_interpolation_function(rows1[:, 3:], rows2[:, 3:], slopes1, slopes2, 1, t_bond)
+        return values
@@ -8,8 +8,20 @@ import datetime
 import timeit
 import os
 import numpy as np
+import io
+from multiprocessing.pool import ThreadPool
+from image_archiver import ImageArchiver
 
-IMAGE_FLAG = 1 # 1 returns three channels (BGR), 0 returns gray
+IMAGE_FLAG = 0 # 0 returns gray (all that the analysis uses), 1 returns three channels (BGR)
+# command of a capture helper that keeps the Flea3 open and writes a binary PGM frame to its
+# stdout for each line read from its stdin, e.g. ["python", "modules/pgm_replay.py", "frames/"]
+# to replay saved frames, None runs ./FCGrab for every frame
+FLEA3_STREAM_COMMAND = None
+PREFETCH_FRAMES = 4 # local images decoded ahead of the frame being read
+DECODE_THREADS = 2
+CAMERA_PORT = 0
+CAMERA_RAMP_FRAMES = 40 # frames discarded when the USB camera is opened
+VIDEO_EXTENSIONS = ['.avi', '.mp4', '.mov', '.mkv', '.wmv']
 
 
 def get_image(experimental_drop, experimental_setup, frame_number):
@@ -17,48 +29,69 @@ def get_image(experimental_drop, experimental_setup, frame_number):
     # experimental_drop.image = np.flipud(cv2.imread('drop.png', 1))
     # experimental_drop.time = timeit.default_timer()
     if frame_number == 0:
-        experimental_setup.time_string = datetime.datetime.now().strftime("%Y-%m-%d-%H%M%S")
-        if experimental_setup.create_folder_boole:
-            filename_less_extension = experimental_setup.filename[:-4] # trim off image extension
-            print(filename_less_extension)
-            new_directory = os.path.join(experimental_setup.directory_string, filename_less_extension + "_" + experimental_setup.time_string)
-            print(new_directory)
-            os.makedirs(new_directory)
-            experimental_setup.directory_string = new_directory
+        initialise_output(experimental_setup)
 
     if (frame_number >= 0) and (experimental_setup.save_images_boole):
         save_image(experimental_drop, experimental_setup, frame_number)
 
+# sets the time stamp of the experiment and creates its folder if requested
+def initialise_output(experimental_setup):
+    experimental_setup.time_string = datetime.datetime.now().strftime("%Y-%m-%d-%H%M%S")
+    if experimental_setup.create_folder_boole:
+        filename_less_extension = experimental_setup.filename[:-4] # trim off image extension
+        print(filename_less_extension)
+        new_directory = os.path.join(experimental_setup.directory_string, filename_less_extension + "_" + experimental_setup.time_string)
+        print(new_directory)
+        os.makedirs(new_directory)
+        experimental_setup.directory_string = new_directory
+
+# the image is written by the experiment's ImageArchiver threads, off the capture path
 def save_image(experimental_drop, experimental_setup, frame_number):
     filename_temp = os.path.join(experimental_setup.directory_string, experimental_setup.filename) # gets the filename for the file to be saved
     time_string = experimental_setup.time_string # imports the time_string from the initial experiment
     filename = filename_temp[:-4] + '_' + time_string + '_' + str(frame_number).zfill(3) + filename_temp[-4:]
-    cv2.imwrite(filename, experimental_drop.image)
+    if experimental_setup.image_archiver is None:
+        experimental_setup.image_archiver = ImageArchiver()
+    experimental_setup.image_archiver.save(filename, experimental_drop.image)
 
 # this routine imports the raw drop image based on user input image source
 # image_source = 0 : Flea3
 # image_source = 1 : USB camera
 # image_source = 2 : image on computer
+# image_source = 3 : frames of a video file (batch mode)
 def import_from_source(experimental_drop, experimental_setup, frame_number):
     image_source = experimental_setup.image_source
     # from Flea3 camera
     if image_source == "Flea3":
-        image_from_Flea3(experimental_drop)
+        image_from_Flea3(experimental_drop, experimental_setup)
     # from USB camera
     elif image_source == "USB camera":
-        image_from_camera(experimental_drop)
+        image_from_camera(experimental_drop, experimental_setup)
     # from specified file
     elif image_source == "Local images":
         image_from_harddrive(experimental_drop, experimental_setup, frame_number)
+    # from the frames of a video file
+    elif image_source == "Video file":
+        image_from_video(experimental_drop, experimental_setup, frame_number)
     # else the value of img_src is incorrect
     else:
         ValueError("Incorrect value for image_source")
     # experimental_drop.time = datetime.datetime.now().strftime("%Y-%m-%d-%H%M%S")
-    experimental_drop.time = timeit.default_timer()
+    if image_source in ["Local images", "Video file"]: # archived frames are timed by the frame interval
+        experimental_drop.time = max(frame_number, 0) * experimental_setup.wait_time
+    else:
+        experimental_drop.time = timeit.default_timer()
     # experimental_drop.image = np.flipud(cv2.imread(experimental_drop.filename, IMAGE_FLAG))
 
 
-def image_from_Flea3(experimental_drop):
+# with FLEA3_STREAM_COMMAND set, frames come from a long-running capture helper (see Flea3Stream),
+# otherwise FCGrab is run for every frame
+def image_from_Flea3(experimental_drop, experimental_setup):
+    if FLEA3_STREAM_COMMAND is not None:
+        if experimental_setup.camera_source is None:
+            experimental_setup.camera_source = Flea3Stream(FLEA3_STREAM_COMMAND)
+        experimental_drop.image = experimental_setup.camera_source.read()
+        return
     subprocess.call(["./FCGrab"])
     temp_filename = 'FCG.pgm'
     experimental_drop.image = cv2.imread(temp_filename, IMAGE_FLAG)
@@ -66,36 +99,175 @@ def image_from_Flea3(experimental_drop):
     # experimental_drop.filename
 
 def image_from_harddrive(experimental_drop, experimental_setup, frame_number):
-    import_filename = get_import_filename(experimental_setup, frame_number)
-    experimental_drop.image = cv2.imread(import_filename, IMAGE_FLAG)
+    if experimental_setup.file_source is None:
+        experimental_setup.file_source = LocalFileSource(experimental_setup.import_files)
+    experimental_drop.image = experimental_setup.file_source.read(frame_number)
 
-def get_import_filename(experimental_setup, frame_number):
-    return experimental_setup.import_files[frame_number*(frame_number>0)] # handles initialisation frame = -1
+# the video is kept open between frames, seeking only if the frames are not read in order
+def image_from_video(experimental_drop, experimental_setup, frame_number):
+    if experimental_setup.video_capture is None:
+        experimental_setup.video_capture = cv2.VideoCapture(experimental_setup.import_files[0])
+    capture = experimental_setup.video_capture
+    frame_number = frame_number*(frame_number>0) # handles initialisation frame = -1
+    if capture.get(cv2.CAP_PROP_POS_FRAMES) != frame_number:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+    retval, image = capture.read()
+    if not retval:
+        raise IOError("Could not read frame %d of %s" % (frame_number, experimental_setup.import_files[0]))
+    if IMAGE_FLAG == 0:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    experimental_drop.image = image
 
-# Captures a single image from the camera and returns it in IplImage format
-def image_from_camera(experimental_drop):
-    grabanimage()    
-    temp_filename = 'USBtemp.png'
-    experimental_drop.image = cv2.imread(temp_filename, IMAGE_FLAG)
+def count_video_frames(filename):
+    capture = cv2.VideoCapture(filename)
+    n_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    capture.release()
+    return n_frames
+
+# Captures a single image from the camera, which stays open for the following frames
+def image_from_camera(experimental_drop, experimental_setup):
+    if experimental_setup.camera_source is None:
+        experimental_setup.camera_source = CameraSource()
+    experimental_drop.image = experimental_setup.camera_source.read()
+
+# closes the camera, video file or image decoding left open by the frames read, and finishes saving images
+def release_sources(experimental_setup):
+    if experimental_setup.file_source is not None:
+        experimental_setup.file_source.release()
+        experimental_setup.file_source = None
+    if experimental_setup.image_archiver is not None:
+        experimental_setup.image_archiver.close()
+        experimental_setup.image_archiver = None
+    if experimental_setup.camera_source is not None:
+        experimental_setup.camera_source.release()
+        experimental_setup.camera_source = None
+    if experimental_setup.video_capture is not None:
+        experimental_setup.video_capture.release()
+        experimental_setup.video_capture = None
+
+class LocalFileSource(object):
+    # decodes the next prefetch files on a thread pool (cv2.imread releases the GIL) while the
+    # current frame is analysed, holding at most prefetch + 1 decoded images
+    def __init__(self, filenames, prefetch=PREFETCH_FRAMES, n_threads=DECODE_THREADS):
+        self.filenames = filenames
+        self.prefetch = prefetch
+        self.pool = ThreadPool(n_threads)
+        self.pending = {}
+
+    # frame -1 (the frame for selecting the regions) is frame 0, which is decoded only once
+    def read(self, frame_number):
+        initialisation_frame = frame_number < 0
+        frame_number = max(frame_number, 0)
+        for i in list(self.pending):
+            if i < frame_number: # skipped frames are not kept
+                del self.pending[i]
+        for i in range(frame_number, min(frame_number + self.prefetch + 1, len(self.filenames))):
+            if i not in self.pending:
+                self.pending[i] = self.pool.apply_async(cv2.imread, (self.filenames[i], IMAGE_FLAG))
+        if initialisation_frame:
+            image = self.pending[frame_number].get()
+        else:
+            image = self.pending.pop(frame_number).get()
+        if image is None:
+            raise IOError("Could not read image " + self.filenames[frame_number])
+        return image
+
+    def release(self):
+        self.pool.terminate()
+        self.pool.join()
+        self.pending = {}
+
+class CameraSource(object):
+    # capture_factory opens the camera (cv2.VideoCapture unless, e.g., a fake camera is given)
+    def __init__(self, camera_port=CAMERA_PORT, ramp_frames=CAMERA_RAMP_FRAMES, capture_factory=None):
+        self.camera_port = camera_port
+        self.ramp_frames = ramp_frames
+        if capture_factory is None:
+            capture_factory = cv2.VideoCapture
+        self.capture_factory = capture_factory
+        self.camera = None
+
+    # the ramp frames let the camera adjust its exposure, once per session
+    def open(self):
+        self.camera = self.capture_factory(self.camera_port)
+        if not self.camera.isOpened():
+            self.camera = None
+            raise IOError("Could not open camera %d" % self.camera_port)
+        for i in xrange(self.ramp_frames):
+            self.camera.read()
+
+    def read(self):
+        if self.camera is None:
+            self.open()
+        print("Taking image...")
+        retval, image = self.camera.read()
+        if not retval:
+            raise IOError("Could not read from camera %d" % self.camera_port)
+        if IMAGE_FLAG == 0:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return image
 
-def grabanimage():
-    camera_port = 0
-    ramp_frames = 40
-    camera = cv2.VideoCapture(camera_port)
+    def release(self):
+        if self.camera is not None:
+            self.camera.release()
+            self.camera = None
 
-    def get_image():
-        retval, im = camera.read()
-        return im
+class Flea3Stream(object):
+    # runs the capture helper command, which stays open for the whole run
+    def __init__(self, command):
+        self.command = command
+        self.process = None
 
-    for i in xrange(ramp_frames):
-        temp = get_image()
-    print("Taking image...")
-# Take the actual image we want to keep
-    camera_capture = get_image()
-    file = "USBtemp.png"
-# A nice feature of the imwrite method is that it will automatically choose the
-# correct format based on the file extension you provide. Convenient!
-    cv2.imwrite(file, camera_capture)
+    def open(self):
+        self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=0)
+        self.stream = io.open(self.process.stdout.fileno(), 'rb', buffering=0, closefd=False)
 
+    # requests a frame and wraps the pixels read from the pipe as an array without copying
+    def read(self):
+        if self.process is None:
+            self.open()
+        self.process.stdin.write(b"\n")
+        self.process.stdin.flush()
+        width, height, maxval = read_pgm_header(self.stream)
+        dtype = np.dtype(np.uint8) if maxval < 256 else np.dtype('>u2')
+        data = bytearray(width * height * dtype.itemsize)
+        view = memoryview(data)
+        n_read = 0
+        while n_read < len(data):
+            n = self.stream.readinto(view[n_read:])
+            if not n:
+                raise IOError("Capture helper %s stopped sending frames" % self.command[0])
+            n_read += n
+        image = np.frombuffer(data, dtype).reshape(height, width)
+        if maxval >= 256:
+            image = (image >> (int(maxval).bit_length() - 8)).astype(np.uint8)
+        if IMAGE_FLAG == 1:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR) # as cv2.imread of the PGM file
+        return image
 
+    def release(self):
+        if self.process is not None:
+            self.process.stdin.close() # the helper exits at the end of its input
+            self.process.wait()
+            self.process = None
 
+# reads the "P5 width height maxval" header of a binary PGM frame, skipping comments
+def read_pgm_header(stream):
+    fields = []
+    token = b""
+    while len(fields) < 4:
+        char = stream.read(1)
+        if not char:
+            raise IOError("End of stream in PGM header")
+        if char == b"#":
+            while char not in (b"\n", b""):
+                char = stream.read(1)
+        if char.isspace():
+            if token:
+                fields.append(token)
+                token = b""
+        else:
+            token += char
+    if fields[0] != b"P5":
+        raise IOError("Not a binary PGM frame")
+    return int(fields[1]), int(fields[2]), int(fields[3])
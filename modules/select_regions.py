@@ -59,6 +59,8 @@ def user_ROI(raw_image, title,  scale, screen_position): #, line_colour=(0, 0, 2
     cv2.setMouseCallback(title, draw_rectangle)
 
     image_TEMP = cv2.resize(raw_image, (0,0), fx=scale, fy=scale)
+    if len(image_TEMP.shape) == 2: # gray frames are shown in colour so the rectangles stand out
+        image_TEMP = cv2.cvtColor(image_TEMP, cv2.COLOR_GRAY2BGR)
 
     img = image_TEMP.copy()
 
@@ -16,6 +16,7 @@ import sys
 import os
 import csv
 
+from fit_data import FITTING_METHODS
 # from classes import ExperimentalSetup
 
 IMAGE_EXTENSION='.png'
@@ -87,6 +88,8 @@ class UserInterface(tk.Toplevel):
         self.density_outer = FloatEntryStyle(self, physical_frame, "Continuous density (kg/m"u"\u00b3""):", rw=1) #, label_width=LABEL_WIDTH)
         self.needle_diameter = FloatComboboxStyle(self, physical_frame, "Needle diameter (mm):", NEEDLE_OPTIONS, rw=2) #, label_width=LABEL_WIDTH)
         self.constant_volume_boole = CheckButtonStyle(self, physical_frame, "Constant volume", rw=3)
+        self.fitting_method = OptionMenuStyle(self, physical_frame, "Fitting method:", FITTING_METHODS, rw=4)
+        self.fitting_method.set_value(FITTING_METHODS[0])
 
         physical_frame.grid_columnconfigure(0, minsize=LABEL_WIDTH)
 
@@ -321,6 +324,8 @@ class UserInterface(tk.Toplevel):
             else:
                 self.directory.set_value(os.getcwd()) # current directory of Terminal
             self.constant_volume_boole.set_value(data[13][1])
+            if (len(data) > 14) and (data[14][1] in FITTING_METHODS): # older parameter files have no fitting method
+                self.fitting_method.set_value(data[14][1])
 
 
 
@@ -343,6 +348,7 @@ class UserInterface(tk.Toplevel):
         user_input_data.filename = temp_filename + IMAGE_EXTENSION
         user_input_data.directory_string = self.directory.get_value()
         user_input_data.consant_volume_boole = self.constant_volume_boole.get_value()
+        user_input_data.fitting_method = self.fitting_method.get_value()
 
 
 
@@ -362,7 +368,8 @@ class UserInterface(tk.Toplevel):
         ('Create new data folder',self.create_new_dir_boole.get_value()),
         ('Filename',self.filename_string.get_value()),
         ('Directory',self.directory.get_value()),
-        ('Constant volume',self.constant_volume_boole.get_value())
+        ('Constant volume',self.constant_volume_boole.get_value()),
+        ('Fitting method',self.fitting_method.get_value())
         ])
         writer = csv.writer(open(PATH_TO_FILE, 'w'))
         for row in parameter_vector:
@@ -13,19 +13,21 @@ from __future__ import print_function
 # # from modules.user_set_regions
 
 
-from modules.classes import ExperimentalSetup, ExperimentalDrop, DropData, Tolerances
+from modules.classes import ExperimentalSetup, ExperimentalDrop
 from modules.PlotManager import PlotManager
+from modules.plot_process import PlotProcess
 from modules.ExtractData import ExtractedData
 from modules.syringe_pump import SyringePump
 
 from modules.user_interface import call_user_input
 from modules.read_image import get_image
+from modules.read_image import initialise_output
+from modules.read_image import release_sources
+from modules.acquisition import FrameAcquisition
+from modules.acquisition import read_frames
 from modules.select_regions import set_regions
-from modules.extract_profile import extract_drop_profile
-from modules.initialise_parameters import initialise_parameters
-from modules.analyse_needle import calculate_needle_diameter
-from modules.fit_data import fit_experimental_drop
-from modules.generate_data import generate_full_data
+from modules.process_frames import initialise_drop_data, initialise_tolerances, get_export_filename
+from modules.process_frames import process_frame, process_frames_parallel
 # from modules. import add_data_to_lists
 
 
@@ -41,139 +43,163 @@ import time
 np.set_printoptions(suppress=True)
 np.set_printoptions(precision=3)
 
-DELTA_TOL = 1.e-6
-GRADIENT_TOL = 1.e-6
-MAXIMUM_FITTING_STEPS = 10
-OBJECTIVE_TOL = 1.e-4
-ARCLENGTH_TOL = 1.e-6
-MAXIMUM_ARCLENGTH_STEPS = 10
-NEEDLE_TOL = 1.e-4
-NEEDLE_STEPS = 20
+# the fitting tolerances and options are set in modules/process_frames.py
+PLOTTING = True # False turns off all plots (e.g. for batch runs) whatever is selected in the user interface
+PLOT_IN_SUBPROCESS = True # draw the plots in a separate process so drawing never holds up the fit
+LIVE_PIPELINE = True # capture live frames on a timer thread while earlier frames are analysed
+PARALLEL_WORKERS = 1 # processes fitting "Local images" at once (no fitting plots when more than 1)
 
 
 
 def main():
     clear_screen()
-    fitted_drop_data = DropData()
-    tolerances = Tolerances(
-        DELTA_TOL,
-        GRADIENT_TOL,
-        MAXIMUM_FITTING_STEPS,
-        OBJECTIVE_TOL,
-        ARCLENGTH_TOL,
-        MAXIMUM_ARCLENGTH_STEPS,
-        NEEDLE_TOL,
-        NEEDLE_STEPS)
+    plot_process = None
+    if PLOTTING and PLOT_IN_SUBPROCESS:
+        plot_process = PlotProcess() # started before the user interface, forking once Tk is running is not safe
+    try:
+        analyse_drops(plot_process)
+    finally:
+        if plot_process is not None:
+            plot_process.close() # draws the snapshots still queued
+
+def analyse_drops(plot_process):
+    fitted_drop_data = initialise_drop_data()
+    tolerances = initialise_tolerances()
     user_inputs = ExperimentalSetup()
     call_user_input(user_inputs)
+    if not PLOTTING:
+        user_inputs.residuals_boole = False
+        user_inputs.profiles_boole = False
+        user_inputs.interfacial_tension_boole = False
+    if user_inputs.residuals_boole or user_inputs.profiles_boole or user_inputs.interfacial_tension_boole:
+        user_inputs.plot_process = plot_process
 
     n_frames = user_inputs.number_of_frames
     extracted_data = ExtractedData(n_frames, fitted_drop_data.parameter_dimensions)
     raw_experiment = ExperimentalDrop()
 
     if user_inputs.interfacial_tension_boole:
-        plots = PlotManager(user_inputs.wait_time, n_frames)
-
-    get_image(raw_experiment, user_inputs, -1)
-    set_regions(raw_experiment, user_inputs)
-
-    initial_volume = 0
-    current_volume = 0
-
-    # Probably want to take user input for this
-    # Threshold is in micro litres
-    threshold = 0.01
-    pump = None
-
-    if (n_frames > 1) and (user_inputs.constant_volume_boole):
-        pump = SyringePump("/dev/ttyUSB0")
-        # Diameter is in mm. We want user input for this too at some point.
-        pump.setDiameter(10)
-        # Accumulator units are dependent on the diameter value given, so we'll
-        # force it to be uL for now.
-        pump.setAccumUnits("UL")
-        pump.clearVolumeAccum("both")
-
-        abs_total_volume_change = 0
-
-    for i in range(n_frames):
-        print("\nProcessing frame %d of %d..." % (i+1, n_frames))
-        time_start = timeit.default_timer()
-        raw_experiment = ExperimentalDrop()
-        get_image(raw_experiment, user_inputs, i) # save image in here...
-        extract_drop_profile(raw_experiment, user_inputs)
-
-        # On the first frame only
-        if i == 0:
-            extracted_data.initial_image_time = raw_experiment.time
-            filename = user_inputs.filename[:-4] + '_' + user_inputs.time_string + ".csv"
-            export_filename = os.path.join(user_inputs.directory_string, filename)
-        initialise_parameters(raw_experiment, fitted_drop_data)
-        calculate_needle_diameter(raw_experiment, fitted_drop_data, tolerances)
-        # fit_experimental_drop(raw_experiment, fitted_drop_data, tolerances)
-        fit_experimental_drop(raw_experiment, fitted_drop_data, user_inputs, tolerances)
-        generate_full_data(extracted_data, raw_experiment, fitted_drop_data, user_inputs, i)
-        data_vector = extracted_data.time_IFT_vol_area(i)
-
-
-        # Volume is in micro litres
-        if user_inputs.constant_volume_boole:
-            # The 3rd element is the drop volume
-            volume = data_vector[2]
-            print("Drop volume for frame {0} is {1:01.6f} uL.".format(i+1, volume))
-
-            if i == 0:
-                initial_volume = volume
-                current_volume = volume
+        plots = PlotManager(user_inputs.wait_time, n_frames, user_inputs.plot_process)
+
+    acquisition = None
+    try:
+        get_image(raw_experiment, user_inputs, -1)
+        set_regions(raw_experiment, user_inputs)
+
+        initial_volume = 0
+        current_volume = 0
+
+        # Probably want to take user input for this
+        # Threshold is in micro litres
+        threshold = 0.01
+        pump = None
+
+        if (n_frames > 1) and (user_inputs.constant_volume_boole):
+            pump = SyringePump("/dev/ttyUSB0")
+            # Diameter is in mm. We want user input for this too at some point.
+            pump.setDiameter(10)
+            # Accumulator units are dependent on the diameter value given, so we'll
+            # force it to be uL for now.
+            pump.setAccumUnits("UL")
+            pump.clearVolumeAccum("both")
+
+            abs_total_volume_change = 0
+            pump_settled_time = 0 # frames captured before this time show the volume before the last pump action
+
+        if (PARALLEL_WORKERS > 1) and (user_inputs.image_source == "Local images") and (n_frames > 1):
+            initialise_output(user_inputs)
+            export_filename = get_export_filename(user_inputs)
+            for i in process_frames_parallel(user_inputs, fitted_drop_data, extracted_data, PARALLEL_WORKERS):
+                if user_inputs.interfacial_tension_boole:
+                    plots.append_data_plot(extracted_data.time_IFT_vol_area(i), i)
+                extracted_data.export_data(export_filename, i)
+        else:
+            if LIVE_PIPELINE and (user_inputs.image_source != "Local images"):
+                acquisition = FrameAcquisition(user_inputs, n_frames)
+                acquisition.start()
+                frames = acquisition.frames()
             else:
-                current_volume = volume
-
-            volume_difference = current_volume - initial_volume
-            abs_total_volume_change += abs(volume_difference)
-
-            if (abs(volume_difference) > threshold) and (i != (n_frames - 1)):
-                print("Difference between current drop volume and initial is {0} uL.".format(volume_difference))
-
-                # If the volume has increased
-                if volume_difference > 0:
-                    pump_direction = "withdraw"
-
-                # If the volume has decreased
-                elif volume_difference < 0:
-                    pump_direction = "infuse"
-
-                # We don't care about the sign anymore, so let's avoid more calls to abs
-                volume_difference = abs(volume_difference)
-
-                # Since volume adjustments are going to be pretty small, we can
-                # perform them in a few seconds without going over the max flow
-                # rate of the pump
-                rate = 60 * (volume_difference / ((int(user_inputs.wait_time) * 0.2)))
-                print("Rate to {0} {1} uL in 5 seconds is {2} uL/min.".format(pump_direction, volume_difference, rate))
-                # Rate is in micro litres per minute
-                units = "UM"
-
-                # This makes the pump automatically stop after the desired
-                # volume has been dispensed
-                pump.setVolumeToDispense(volume_difference)
-                pump.setDirection(pump_direction)
-                pump.setRate(rate, units)
-
-                pump.run()
-
-                print("Absolute total volume difference: {0}".format(abs_total_volume_change))
-                print("Pumping...")
-                print("Volume accumulator in nL (infuse, withdraw): {0}".format(pump.getVolumeAccum()))
-
-
-        if user_inputs.interfacial_tension_boole:
-            plots.append_data_plot(data_vector, i)
-
-        if i != (n_frames - 1):
-            time_loop = timeit.default_timer() - time_start
-            pause_wait_time(time_loop, user_inputs.wait_time)
-
-        extracted_data.export_data(export_filename,i)
+                frames = read_frames(user_inputs, n_frames) # save image in here...
+            for i, raw_experiment in frames:
+                print("\nProcessing frame %d of %d..." % (i+1, n_frames))
+                time_start = timeit.default_timer()
+
+                # On the first frame only
+                if i == 0:
+                    export_filename = get_export_filename(user_inputs)
+                data_vector = process_frame(raw_experiment, fitted_drop_data, user_inputs, tolerances, extracted_data, i)
+
+
+                # Volume is in micro litres
+                if user_inputs.constant_volume_boole:
+                    # The 3rd element is the drop volume
+                    volume = data_vector[2]
+                    print("Drop volume for frame {0} is {1:01.6f} uL.".format(i+1, volume))
+
+                    if i == 0:
+                        initial_volume = volume
+                        current_volume = volume
+                    else:
+                        current_volume = volume
+
+                    volume_difference = current_volume - initial_volume
+                    abs_total_volume_change += abs(volume_difference)
+
+                    # frames queued by the acquisition thread may have been captured before the pump last ran
+                    if (acquisition is not None) and (raw_experiment.time < pump_settled_time):
+                        print("Frame {0} was captured before the last pump action finished, the pump is left alone.".format(i+1))
+                    elif (abs(volume_difference) > threshold) and (i != (n_frames - 1)):
+                        print("Difference between current drop volume and initial is {0} uL.".format(volume_difference))
+
+                        # If the volume has increased
+                        if volume_difference > 0:
+                            pump_direction = "withdraw"
+
+                        # If the volume has decreased
+                        elif volume_difference < 0:
+                            pump_direction = "infuse"
+
+                        # We don't care about the sign anymore, so let's avoid more calls to abs
+                        volume_difference = abs(volume_difference)
+
+                        # Since volume adjustments are going to be pretty small, we can
+                        # perform them in a few seconds without going over the max flow
+                        # rate of the pump
+                        rate = 60 * (volume_difference / ((int(user_inputs.wait_time) * 0.2)))
+                        print("Rate to {0} {1} uL in 5 seconds is {2} uL/min.".format(pump_direction, volume_difference, rate))
+                        # Rate is in micro litres per minute
+                        units = "UM"
+
+                        # This makes the pump automatically stop after the desired
+                        # volume has been dispensed
+                        pump.setVolumeToDispense(volume_difference)
+                        pump.setDirection(pump_direction)
+                        pump.setRate(rate, units)
+
+                        pump.run()
+                        pump_settled_time = timeit.default_timer() + 60 * volume_difference / rate
+
+                        print("Absolute total volume difference: {0}".format(abs_total_volume_change))
+                        print("Pumping...")
+                        print("Volume accumulator in nL (infuse, withdraw): {0}".format(pump.getVolumeAccum()))
+
+
+                if user_inputs.interfacial_tension_boole:
+                    plots.append_data_plot(data_vector, i)
+
+                if acquisition is not None:
+                    print("Frames waiting for analysis: %d" % acquisition.queue_depth())
+                elif i != (n_frames - 1):
+                    time_loop = timeit.default_timer() - time_start
+                    pause_wait_time(time_loop, user_inputs.wait_time)
+
+                extracted_data.export_data(export_filename,i)
+            if acquisition is not None:
+                acquisition.print_summary()
+    finally:
+        if acquisition is not None:
+            acquisition.stop() # the camera is not read once it is released
+        release_sources(user_inputs) # also when a frame cannot be read or fitted
 #    cheeky_pause()
 
 def clear_screen():
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+#coding=utf-8
+from __future__ import unicode_literals
+from __future__ import print_function
+# headless batch processing: python opendrop_batch.py config.csv images|directory|video ...
+# the config file has the rows of the parameters.csv saved by the user interface, plus
+#     Drop region,x_min,y_min,x_max,y_max
+#     Needle region,x_min,y_min,x_max,y_max
+# in (integer) image pixels, no windows are opened and nothing is plotted
+import matplotlib
+matplotlib.use('Agg') # no display is needed
+
+from modules.process_frames import initialise_drop_data, initialise_tolerances, get_export_filename
+from modules.process_frames import process_frame, process_frames_parallel, IMAGE_EXTENSION
+from modules.classes import ExperimentalSetup, ExperimentalDrop
+from modules.ExtractData import ExtractedData
+from modules.read_image import get_image, initialise_output, release_sources, count_video_frames, VIDEO_EXTENSIONS
+
+import os
+import csv
+import argparse
+import timeit
+import multiprocessing
+
+IMAGE_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.pgm']
+
+# config rows read as numbers, and the ExperimentalSetup attribute each sets
+CONFIG_FLOATS = [('Drop density', 'drop_density'),
+                 ('Continuous density', 'continuous_density'),
+                 ('Needle diameter', 'needle_diameter_mm'),
+                 ('Wait time', 'wait_time')]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fits the drops in a series of images without a display.")
+    parser.add_argument("config", help="parameters csv file, with drop and needle regions")
+    parser.add_argument("inputs", nargs="+", help="image files, directories of images, or a video file")
+    parser.add_argument("-w", "--workers", type=int, default=multiprocessing.cpu_count(),
+                        help="number of processes fitting frames at once (default: number of cores)")
+    args = parser.parse_args(argv)
+
+    user_inputs = ExperimentalSetup()
+    try:
+        read_config(args.config, user_inputs)
+        set_image_source(args.inputs, user_inputs)
+    except (IOError, ValueError) as error:
+        parser.error(str(error))
+    run_batch(user_inputs, args.workers)
+
+# fits every frame, appending each to the output csv (in frame order) as it is done
+def run_batch(user_inputs, n_workers=1):
+    fitted_drop_data = initialise_drop_data()
+    tolerances = initialise_tolerances()
+    n_frames = user_inputs.number_of_frames
+    extracted_data = ExtractedData(n_frames, fitted_drop_data.parameter_dimensions)
+    time_start = timeit.default_timer()
+    try:
+        if (n_workers > 1) and (n_frames > 1):
+            initialise_output(user_inputs)
+            export_filename = get_export_filename(user_inputs)
+            for i in process_frames_parallel(user_inputs, fitted_drop_data, extracted_data, n_workers):
+                extracted_data.export_data(export_filename, i)
+        else:
+            for i in range(n_frames):
+                print("\nProcessing frame %d of %d..." % (i+1, n_frames))
+                raw_experiment = ExperimentalDrop()
+                get_image(raw_experiment, user_inputs, i)
+                if i == 0:
+                    export_filename = get_export_filename(user_inputs)
+                process_frame(raw_experiment, fitted_drop_data, user_inputs, tolerances, extracted_data, i)
+                extracted_data.export_data(export_filename, i)
+    finally:
+        release_sources(user_inputs) # also when a frame cannot be read or fitted
+    print("\n%d frames fitted in %.1f s, results saved to %s" % (n_frames, timeit.default_timer() - time_start, export_filename))
+
+# reads the settings saved by user_interface.export_parameters and the regions of interest
+def read_config(filename, user_inputs):
+    with open(filename, 'r') as f:
+        rows = dict((row[0].strip(), [value.strip() for value in row[1:]]) for row in csv.reader(f) if row)
+    for label, attribute in CONFIG_FLOATS:
+        if label not in rows:
+            raise ValueError("%s is missing from %s" % (label, filename))
+        setattr(user_inputs, attribute, float(rows[label][0]))
+    user_inputs.drop_region = read_region(rows, 'Drop region', filename)
+    user_inputs.needle_region = read_region(rows, 'Needle region', filename)
+    temp_filename = rows.get('Filename', [''])[0]
+    if temp_filename == '':
+        temp_filename = "Extracted_data"
+    user_inputs.filename = temp_filename + IMAGE_EXTENSION
+    user_inputs.directory_string = rows.get('Directory', [''])[0]
+    if not os.path.isdir(user_inputs.directory_string):
+        user_inputs.directory_string = os.getcwd()
+    user_inputs.create_folder_boole = int(rows.get('Create new data folder', ['0'])[0] or 0)
+    user_inputs.fitting_method = rows.get('Fitting method', [None])[0]
+    user_inputs.residuals_boole = False
+    user_inputs.profiles_boole = False
+    user_inputs.interfacial_tension_boole = False
+    user_inputs.save_images_boole = False
+    user_inputs.constant_volume_boole = False
+
+def read_region(rows, label, filename):
+    if (label not in rows) or (len(rows[label]) < 4):
+        raise ValueError("%s (x_min, y_min, x_max, y_max) is missing from %s" % (label, filename))
+    x_min, y_min, x_max, y_max = [int(value) for value in rows[label][:4]]
+    return [(min(x_min, x_max), min(y_min, y_max)), (max(x_min, x_max), max(y_min, y_max))]
+
+# a single video file, or images and directories of images (in name order)
+def set_image_source(inputs, user_inputs):
+    if (len(inputs) == 1) and (os.path.splitext(inputs[0])[1].lower() in VIDEO_EXTENSIONS):
+        if not os.path.isfile(inputs[0]):
+            raise IOError("No such video file: " + inputs[0])
+        user_inputs.image_source = "Video file"
+        user_inputs.import_files = inputs
+        user_inputs.number_of_frames = count_video_frames(inputs[0])
+    else:
+        user_inputs.image_source = "Local images"
+        user_inputs.import_files = []
+        for path in inputs:
+            if os.path.isdir(path):
+                user_inputs.import_files += sorted(os.path.join(path, name) for name in os.listdir(path)
+                                                   if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS)
+            elif os.path.isfile(path):
+                user_inputs.import_files.append(path)
+            else:
+                raise IOError("No such file or directory: " + path)
+        user_inputs.number_of_frames = len(user_inputs.import_files)
+    if user_inputs.number_of_frames == 0:
+        raise ValueError("No frames to process")
+
+
+if __name__ == '__main__':
+    main()